@@ -0,0 +1,108 @@
+import asyncio
+import time
+from typing import Callable
+
+import orjson
+
+from src.database.rabbit import RabbitMessageProcessor, RabbitReader
+from src.settings.rabbit import RabbitSettings
+
+
+class FakeIncomingMessage:
+    def __init__(self, channel: "FakeChannel", delivery_tag: int, body: bytes) -> None:
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = body
+        self.exchange = ""
+        self.routing_key = "emails"
+        self.message_id = None
+        self.published_at = time.perf_counter()
+
+    async def ack(self, multiple: bool = False) -> None:
+        self.channel.settle(self.delivery_tag, multiple, acked=True)
+
+    async def nack(self, requeue: bool = False) -> None:
+        self.channel.settle(self.delivery_tag, False, acked=False)
+
+
+class FakeChannel:
+    """Канал и очередь брокера в памяти с семантикой basic.consume: не больше prefetch_count
+    неподтвержденных сообщений, ack с multiple подтверждает все сообщения до delivery_tag."""
+
+    def __init__(self, prefetch_count: int) -> None:
+        self.prefetch_count = prefetch_count
+        self.is_closed = False
+        self.published = 0
+        self.acked = 0
+        self.nacked = 0
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+        self._ready: asyncio.Queue[FakeIncomingMessage] = asyncio.Queue()
+        self._unacked: dict[int, float] = {}
+        self._window = asyncio.Event()
+        self._window.set()
+        self._deliver: asyncio.Task | None = None
+
+    @property
+    def channel(self) -> "FakeChannel":
+        return self
+
+    def publish(self, payload: dict) -> None:
+        self.published += 1
+        self._ready.put_nowait(FakeIncomingMessage(self, self.published, orjson.dumps(payload)))
+
+    def settle(self, delivery_tag: int, multiple: bool, acked: bool) -> None:
+        tags = [tag for tag in self._unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        now = time.perf_counter()
+        for tag in tags:
+            published_at = self._unacked.pop(tag)
+            if acked:
+                self.acked += 1
+                self.latencies.append(now - published_at)
+            else:
+                self.nacked += 1
+        if len(self._unacked) < self.prefetch_count:
+            self._window.set()
+        if self.acked + self.nacked >= self.published:
+            self.done.set()
+
+    async def consume(self, callback: Callable) -> str:
+        self._deliver = asyncio.create_task(self._deliver_messages(callback))
+        return "benchmark"
+
+    async def cancel(self, consumer_tag: str) -> None:
+        if self._deliver:
+            self._deliver.cancel()
+
+    async def _deliver_messages(self, callback: Callable) -> None:
+        while True:
+            message = await self._ready.get()
+            await self._window.wait()
+            self._unacked[message.delivery_tag] = message.published_at
+            if len(self._unacked) >= self.prefetch_count:
+                self._window.clear()
+            await callback(message)
+
+
+class FakeConnectionManager:
+    def __init__(self, channel: FakeChannel) -> None:
+        self.connection = channel
+        self.queue = channel
+
+    async def is_connected(self) -> bool:
+        return True
+
+    async def close(self) -> None:
+        pass
+
+
+def fake_rabbit_processor(prefetch_count: int) -> tuple[RabbitMessageProcessor, FakeChannel]:
+    """Настоящие RabbitMessageProcessor и RabbitReader поверх брокера в памяти.
+
+    Сообщения проходят тот же путь, что и из RabbitMQ: буфер подписки, декодирование,
+    подтверждения через AckAggregator. Время от публикации до ack фиксирует канал.
+    """
+    channel = FakeChannel(prefetch_count)
+    reader = RabbitReader(RabbitSettings(prefetch_count=prefetch_count, read_mode="consume"))
+    reader._connection_manager = FakeConnectionManager(channel)
+    return RabbitMessageProcessor(reader), channel
@@ -0,0 +1,71 @@
+import asyncio
+import random
+
+
+class FakeSMTPServer:
+    """SMTP приемник на asyncio: принимает любые письма без STARTTLS и проверки логина.
+
+    latency - задержка перед ответом на DATA, failure_rate - доля писем, отклоненных кодом 451.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, failure_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.accepted = 0
+        self.rejected = 0
+        self.connections = 0
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    @staticmethod
+    async def _read_data(reader: asyncio.StreamReader) -> None:
+        # Построчно: readuntil по всему письму упирается в лимит буфера StreamReader
+        while await reader.readline() not in (b".\r\n", b""):
+            pass
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        async def reply(line: str) -> None:
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        try:
+            await reply("220 fake-smtp ESMTP")
+            while line := await reader.readline():
+                command = line[:4].upper()
+                if command == b"EHLO":
+                    await reply("250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME")
+                elif command == b"AUTH":
+                    await reply("235 Authentication successful")
+                elif command == b"DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    await self._read_data(reader)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if random.random() < self.failure_rate:
+                        self.rejected += 1
+                        await reply("451 Try again later")
+                    else:
+                        self.accepted += 1
+                        await reply("250 OK")
+                elif command == b"QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    # MAIL, RCPT, RSET, NOOP
+                    await reply("250 OK")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
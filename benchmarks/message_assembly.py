@@ -0,0 +1,89 @@
+"""Микробенчмарк сборки письма: build_message через email против быстрого пути prepare_message.
+
+Считается сборка вместе с сериализацией в байты для SMTP, как перед отправкой.
+
+    python -m benchmarks.message_assembly --iterations 20000
+"""
+import argparse
+import mimetypes
+import os
+import time
+from functools import partial
+from typing import Callable
+
+import orjson
+
+SUBJECTS = {"ascii": "Your order has been shipped", "unicode": "Ваш заказ отправлен"}
+TEXTS = {
+    "ascii": "Hello!\nYour order #12345 has been shipped and will arrive soon.\n",
+    "unicode": "Здравствуйте!\nВаш заказ №12345 отправлен и скоро будет у вас.\n",
+}
+
+
+def html_body(text: str, size: int) -> str:
+    paragraph = f"<p>{text}</p>\n"
+    return "<html><body>\n" + paragraph * max(1, size // len(paragraph)) + "</body></html>\n"
+
+
+def measure(func: Callable[[], object], iterations: int) -> float:
+    """Микросекунд на вызов, лучший из трех прогонов."""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1_000_000
+
+
+def run(args: argparse.Namespace) -> dict:
+    from src.service.message_assembly import build_message, guess_mime_type, prepare_message
+
+    def with_email(to: str, subject: str, text: str, html: str) -> bytes:
+        msg = build_message(to, subject, text, html, None)
+        return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+    def fast(to: str, subject: str, text: str, html: str) -> bytes:
+        return prepare_message(to, subject, text, html).data
+
+    results = {}
+    for charset in args.charsets:
+        subject, text = SUBJECTS[charset], TEXTS[charset]
+        html = html_body(text, args.html_size)
+        email_us = measure(partial(with_email, "user@example.com", subject, text, html), args.iterations)
+        fast_us = measure(partial(fast, "user@example.com", subject, text, html), args.iterations)
+        results[f"text+html {charset}"] = {"email_us": email_us, "fast_us": fast_us, "speedup": email_us / fast_us}
+
+    filenames = [f"file{index}.{ext}" for index, ext in enumerate(["pdf", "png", "docx", "csv", "zip"] * 20)]
+    guess_us = measure(lambda: [mimetypes.guess_type(name) for name in filenames], args.iterations // 10)
+    cached_us = measure(lambda: [guess_mime_type(name) for name in filenames], args.iterations // 10)
+    results["mime type x100"] = {"email_us": guess_us, "fast_us": cached_us, "speedup": guess_us / cached_us}
+    return results
+
+
+def print_report(results: dict) -> None:
+    print(f"{'случай':<22}{'email, мкс':>14}{'быстрый, мкс':>16}{'ускорение':>12}")
+    for case, stats in results.items():
+        print(f"{case:<22}{stats['email_us']:>14.1f}{stats['fast_us']:>16.1f}{stats['speedup']:>11.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--html-size", type=int, default=4096, help="примерный размер HTML части в символах")
+    parser.add_argument("--charsets", nargs="+", choices=sorted(TEXTS), default=sorted(TEXTS))
+    parser.add_argument("--json", dest="json_path", default=None, help="записать результат в JSON файл")
+    args = parser.parse_args()
+
+    # Настройки сервиса читаются при импорте модулей src, поэтому окружение готовится до импорта
+    os.environ.setdefault("EMAIL_SERVICE_EMAIL_FROM", "Benchmark <benchmark@example.com>")
+
+    results = run(args)
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, "wb") as file:
+            file.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
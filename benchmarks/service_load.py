@@ -0,0 +1,171 @@
+"""Нагрузочный прогон Service от начала до конца: брокер в памяти, SMTP приемник на asyncio, настоящий Postgres.
+
+Сообщения идут через настоящие RabbitMessageProcessor и RabbitReader: буфер подписки и AckAggregator
+работают как с RabbitMQ, заменены только канал и очередь. Сеть до брокера и его подтверждения не измеряются.
+
+Postgres берется из обычных переменных EMAIL_SERVICE_POSTGRES_*, база должна быть мигрирована
+(alembic upgrade head). Остальные настройки сервиса тоже можно менять переменными EMAIL_SERVICE_*.
+
+    python -m benchmarks.service_load --messages 5000 --workers 32 --smtp-latency 0.005
+"""
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import socket
+import sys
+import time
+from collections import defaultdict
+
+import orjson
+from prometheus_client import Histogram
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def record_observations() -> dict[tuple[str, tuple[str, ...]], list[float]]:
+    """Сохраняет каждое наблюдение гистограмм Prometheus, чтобы считать точные перцентили по этапам."""
+    samples: dict[tuple[str, tuple[str, ...]], list[float]] = defaultdict(list)
+    original = Histogram.observe
+
+    def observe(self: Histogram, amount: float, exemplar: dict[str, str] | None = None) -> None:
+        samples[(self._name, self._labelvalues)].append(amount)
+        original(self, amount, exemplar)
+
+    Histogram.observe = observe
+    return samples
+
+
+def build_payload(index: int, args: argparse.Namespace, attachment: str | None) -> dict:
+    payload = {
+        "to": f"user{index}@example{index % args.domains}.com",
+        "subject": f"Benchmark {index}",
+        "message": "Plain text part of the benchmark email",
+        "template": args.template,
+        "context": {"name": f"user{index % args.distinct_contexts}"},
+    }
+    if attachment:
+        payload["attachments"] = [{"filename": "report.pdf", "content": attachment}]
+    return payload
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from benchmarks.fake_broker import fake_rabbit_processor
+    from benchmarks.fake_smtp import FakeSMTPServer
+    from src.database.postgres import SessionManager
+    from src.service.renderer import render_engine, warm_up_templates
+    from src.service.service import Service
+    from src.service.smtp_pool import async_smtp_pool, smtp_pool
+    from src.settings.app import settings
+
+    samples = record_observations()
+    smtp = FakeSMTPServer(port=settings.smtp_port, latency=args.smtp_latency, failure_rate=args.smtp_failure_rate)
+    await smtp.start()
+    warm_up_templates()
+
+    processor, broker = fake_rabbit_processor(prefetch_count=args.prefetch or args.workers)
+    attachment = base64.b64encode(os.urandom(args.attachment_size)).decode() if args.attachment_size else None
+    for index in range(args.messages):
+        broker.publish(build_payload(index, args, attachment))
+
+    service = Service(SessionManager(settings.postgres), processor, workers=args.workers)
+    started = time.perf_counter()
+    task = asyncio.create_task(service.run())
+    try:
+        await asyncio.wait_for(broker.done.wait(), timeout=args.timeout)
+    finally:
+        elapsed = time.perf_counter() - started
+        service.stop()
+        await task
+        await processor.close()
+        render_engine.close()
+        await async_smtp_pool.close()
+        await asyncio.to_thread(smtp_pool.close)
+        await smtp.stop()
+
+    stages = {
+        labels[0] if name == "stage_duration" else "_".join((name.removesuffix("_duration"), *labels)): {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+        for (name, labels), values in sorted(samples.items())
+    }
+    return {
+        "messages": args.messages,
+        "acked": broker.acked,
+        "nacked": broker.nacked,
+        "smtp_accepted": smtp.accepted,
+        "smtp_rejected": smtp.rejected,
+        "smtp_connections": smtp.connections,
+        "seconds": elapsed,
+        "emails_per_sec": broker.acked / elapsed if elapsed else 0.0,
+        "latency_p50_ms": percentile(broker.latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(broker.latencies, 0.99) * 1000,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": stages,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(
+        f"Сообщений: {result['acked']}/{result['messages']} за {result['seconds']:.2f} с, "
+        f"{result['emails_per_sec']:.1f} писем/с"
+    )
+    print(
+        f"SMTP: принято {result['smtp_accepted']}, отклонено {result['smtp_rejected']}, "
+        f"соединений {result['smtp_connections']}"
+    )
+    print(f"Задержка до ack: p50 {result['latency_p50_ms']:.2f} мс, p99 {result['latency_p99_ms']:.2f} мс")
+    print(f"Пиковая память: {result['max_rss_mb']:.1f} МБ")
+    print(f"{'этап':<18}{'count':>8}{'p50, мс':>12}{'p99, мс':>12}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<18}{stats['count']:>8}{stats['p50_ms']:>12.3f}{stats['p99_ms']:>12.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--prefetch", type=int, default=None, help="по умолчанию равен --workers")
+    parser.add_argument("--domains", type=int, default=1, help="на сколько доменов распределить получателей")
+    parser.add_argument("--template", default=None, help="шаблон из src/service/templates")
+    parser.add_argument("--distinct-contexts", type=int, default=100, help="сколько разных контекстов рендера")
+    parser.add_argument("--attachment-size", type=int, default=0, help="размер вложения в байтах, 0 - без вложений")
+    parser.add_argument("--smtp-latency", type=float, default=0.0, help="задержка ответа на DATA в секундах")
+    parser.add_argument("--smtp-failure-rate", type=float, default=0.0, help="доля писем с ответом 451")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", dest="json_path", default=None, help="записать результат в JSON файл")
+    parser.add_argument("--min-rate", type=float, default=None, help="код выхода 1, если писем/с меньше")
+    args = parser.parse_args()
+
+    # Настройки сервиса читаются при импорте модулей src, поэтому окружение готовится до импорта
+    os.environ["EMAIL_SERVICE_SMTP_HOST"] = "127.0.0.1"
+    os.environ["EMAIL_SERVICE_SMTP_PORT"] = str(free_port())
+    os.environ["EMAIL_SERVICE_SMTP_STARTTLS"] = "false"
+    os.environ.setdefault("EMAIL_SERVICE_EMAIL_FROM", "benchmark@example.com")
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, "wb") as file:
+            file.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    if args.min_rate is not None and result["emails_per_sec"] < args.min_rate:
+        print(f"Пропускная способность ниже порога {args.min_rate} писем/с", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,4 +6,4 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 echo "Starting service..."
-exec /app/.venv/bin/python -m src.main
+exec /app/.venv/bin/python -m src.supervisor
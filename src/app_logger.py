@@ -1,8 +1,77 @@
+import atexit
 import logging
-from typing import Any
+import queue
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Iterator
+
+import orjson
 
 from src.settings.app import settings
 
+_log_context: ContextVar[dict[str, Any] | None] = ContextVar("log_context", default=None)
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Добавляет поля корреляции (delivery_tag, email_id) ко всем логам внутри блока, в том числе из потоков
+    asyncio.to_thread."""
+    token = _log_context.set({**(_log_context.get() or {}), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля корреляции в запись и прореживает INFO/DEBUG логи обработки сообщений.
+
+    Решение о выборке принимается по полям корреляции, поэтому логи одного сообщения
+    либо пишутся все, либо не пишутся вовсе. WARNING и выше пишутся всегда.
+    """
+
+    def __init__(self, sample_rate: float = 1.0) -> None:
+        super().__init__()
+        self.threshold = int(sample_rate * 10000)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get() or {}
+        record.context = context
+        record.correlation = "".join(f" [{key}={value}]" for key, value in context.items())
+        if not context or record.levelno >= logging.WARNING or self.threshold >= 10000:
+            return True
+        key = str(next(iter(context.values()))).encode()
+        return zlib.crc32(key) % 10000 < self.threshold
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """При переполненной очереди запись отбрасывается: медленный вывод логов не должен останавливать event loop."""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
 class AppLogger(logging.Logger):
     _instance = None
@@ -29,12 +98,26 @@ class AppLogger(logging.Logger):
     ) -> None:
         logger_name = logger_name or __name__
         super().__init__(logger_name, *args, **kwargs)
-        fmt = fmt or "[%(asctime)s] [%(levelname)-8s] [%(name)s]: %(message)s"
-        formatter = logging.Formatter(fmt=fmt)
+        # Уровень на самом логгере: отключенные вызовы отсекаются до создания записи
+        self.setLevel(log_level)
+        self.addFilter(ContextFilter(settings.log_sample_rate))
+        if settings.log_format == "json":
+            formatter = JsonFormatter()
+        else:
+            fmt = fmt or "[%(asctime)s] [%(levelname)-8s] [%(name)s]%(correlation)s: %(message)s"
+            formatter = logging.Formatter(fmt=fmt)
         ch = logging.StreamHandler()
         ch.setLevel(level=log_level)
         ch.setFormatter(formatter)
-        self.addHandler(ch)
+        self.listener = None
+        if settings.log_async:
+            # Запись в поток вывода идет в отдельном потоке QueueListener
+            self.addHandler(DroppingQueueHandler(queue.Queue(maxsize=settings.log_queue_size)))
+            self.listener = QueueListener(self.handlers[0].queue, ch, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.listener.stop)
+        else:
+            self.addHandler(ch)
 
 
 app_logger = AppLogger(log_level=settings.log_level)
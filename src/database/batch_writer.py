@@ -0,0 +1,168 @@
+import asyncio
+from contextlib import suppress
+from typing import Any
+
+from sqlalchemy import Integer, Text, cast, column, insert, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app_logger import app_logger
+from src.database.email_body_store import email_body_store
+from src.database.models.email_data import EmailData, StatusType
+from src.database.postgres import SessionManager
+from src.settings.prometheus import PrometheusMetrics
+
+
+async def insert_emails(session: AsyncSession, rows: list[dict[str, Any]]) -> list[int | None]:
+    """Вставляет строки EmailData и возвращает их id в порядке rows.
+
+    Строки с idempotency_key вставляются через ON CONFLICT DO NOTHING: для ключа, который уже есть
+    в таблице или повторяется в rows, вместо id возвращается None.
+    """
+    with PrometheusMetrics.stage_duration.labels(stage="db_insert").time():
+        return await _insert_emails(session, rows)
+
+
+async def _insert_emails(session: AsyncSession, rows: list[dict[str, Any]]) -> list[int | None]:
+    plain = [row for row in rows if not row.get("idempotency_key")]
+    keyed: dict[str, dict[str, Any]] = {}
+    for row in rows:
+        if row.get("idempotency_key"):
+            keyed.setdefault(row["idempotency_key"], row)
+
+    plain_ids = iter([])
+    if plain:
+        result = await session.execute(
+            insert(EmailData).returning(EmailData.id, sort_by_parameter_order=True),
+            plain,
+        )
+        plain_ids = iter(result.scalars().all())
+    keyed_ids = {}
+    if keyed:
+        result = await session.execute(
+            pg_insert(EmailData)
+            .on_conflict_do_nothing(index_elements=[EmailData.idempotency_key])
+            .returning(EmailData.id, EmailData.idempotency_key),
+            list(keyed.values()),
+        )
+        keyed_ids = {key: email_id for email_id, key in result}
+
+    ids = []
+    for row in rows:
+        key = row.get("idempotency_key")
+        ids.append(keyed_ids.pop(key, None) if key else next(plain_ids))
+    return ids
+
+
+class EmailDataBatchWriter:
+    """Копит вставки и смены статусов EmailData и пишет их пачками в одной транзакции.
+
+    Вставки уходят одним INSERT ... RETURNING id на много строк, смены статусов -
+    одним UPDATE ... FROM (VALUES ...). Вызывающий получает результат только после
+    коммита пачки, поэтому подтверждать сообщение в RabbitMQ можно сразу после await.
+    """
+
+    def __init__(self, session_manager: SessionManager, batch_size: int, max_latency: float) -> None:
+        self.session_manager = session_manager
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._inserts: list[tuple[tuple[dict[str, Any], tuple[str, str] | None], asyncio.Future]] = []
+        self._updates: list[tuple[tuple[int, StatusType, str | None], asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._inserts) + len(self._updates)
+
+    async def _enqueue(self, queue: list, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        queue.append((item, future))
+        if self._closed:
+            await self.flush()
+        elif self.pending >= self.batch_size:
+            self._wakeup.set()
+        return await future
+
+    async def insert(self, values: dict[str, Any], shared_body: tuple[str, str] | None = None) -> int | None:
+        """shared_body - пара (хеш, тело) для записи в email_body в той же транзакции.
+
+        Возвращает None, если письмо с таким idempotency_key уже записано.
+        """
+        return await self._enqueue(self._inserts, (values, shared_body))
+
+    async def update_status(self, email_id: int, status: StatusType, error: str | None = None) -> None:
+        await self._enqueue(self._updates, (email_id, status, error))
+
+    @staticmethod
+    async def _update(session: AsyncSession, rows: list[tuple[int, StatusType, str | None]]) -> None:
+        if not rows:
+            return
+        batch = values(
+            column("id", Integer),
+            column("status", EmailData.status.type),
+            column("error", Text),
+            name="batch",
+        ).data(rows)
+        await session.execute(
+            update(EmailData)
+            .where(EmailData.id == batch.c.id)
+            .values(status=cast(batch.c.status, EmailData.status.type), error=batch.c.error)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _commit(self, inserts: list, updates: list) -> None:
+        """Пишет записи в одной транзакции и после коммита отдает результаты вызывающим."""
+        bodies = dict(shared_body for (_, shared_body), _ in inserts if shared_body)
+        async with self.session_manager() as session:
+            stored = await email_body_store.save(session, bodies) if bodies else []
+            ids = await insert_emails(session, [values for (values, _), _ in inserts])
+            await self._update(session, [item for item, _ in updates])
+        email_body_store.remember(stored)
+
+        for (_, future), email_id in zip(inserts, ids, strict=True):
+            if not future.done():
+                future.set_result(email_id)
+        for _, future in updates:
+            if not future.done():
+                future.set_result(None)
+
+    async def _commit_or_fail(self, inserts: list, updates: list) -> None:
+        try:
+            await self._commit(inserts, updates)
+        except Exception as e:
+            app_logger.error(f"Ошибка записи в Postgres: {e}")
+            for _, future in inserts + updates:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def flush(self) -> None:
+        inserts, self._inserts = self._inserts, []
+        updates, self._updates = self._updates, []
+        if not inserts and not updates:
+            return
+        if len(inserts) + len(updates) == 1:
+            await self._commit_or_fail(inserts, updates)
+            return
+
+        try:
+            await self._commit(inserts, updates)
+        except Exception as e:
+            # Одна плохая строка не должна ронять всю пачку: каждая запись повторяется в своей транзакции,
+            # и ошибку получает только тот, чья запись не прошла
+            app_logger.warning(f"Ошибка пакетной записи в Postgres, записи повторяются по одной: {e}")
+            for entry in inserts:
+                await self._commit_or_fail([entry], [])
+            for entry in updates:
+                await self._commit_or_fail([], [entry])
+
+    async def run(self) -> None:
+        while not self._closed or self.pending:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.max_latency)
+            self._wakeup.clear()
+            await self.flush()
+
+    def stop(self) -> None:
+        self._closed = True
+        self._wakeup.set()
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models.email_body import EmailBody
+
+
+class EmailBodyStore:
+    """Сохраняет тела писем в email_body один раз на хеш.
+
+    Хеши, уже записанные этим процессом, запоминаются, чтобы не пересылать в Postgres
+    одно и то же тело для каждой строки рассылки. Запоминать хеши нужно только после коммита.
+    """
+
+    def __init__(self, max_known: int = 10000) -> None:
+        self.max_known = max_known
+        self._known: OrderedDict[str, None] = OrderedDict()
+
+    async def save(self, session: AsyncSession, bodies: dict[str, str]) -> list[str]:
+        new = {body_hash: body for body_hash, body in bodies.items() if body_hash not in self._known}
+        if new:
+            await session.execute(
+                insert(EmailBody)
+                .values([{"hash": body_hash, "body": body} for body_hash, body in new.items()])
+                .on_conflict_do_nothing(index_elements=[EmailBody.hash])
+            )
+        return list(new)
+
+    def remember(self, hashes: list[str]) -> None:
+        for body_hash in hashes:
+            self._known[body_hash] = None
+            self._known.move_to_end(body_hash)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+
+email_body_store = EmailBodyStore()
@@ -1,5 +1,7 @@
+from .email_body import EmailBody
 from .email_data import EmailData
 
 __all__ = [
+    "EmailBody",
     "EmailData",
 ]
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, DateTime, String, Text, func
+
+from src.database.postgres import Base
+
+
+class EmailBody(Base):
+    __tablename__ = "email_body"
+    __table_args__ = {"schema": "emails"}
+
+    hash = Column(String(64), primary_key=True)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
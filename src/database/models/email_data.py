@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Column, DateTime, Enum, Integer, String, Text
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy.dialects.postgresql import JSONB
 
 from src.database.postgres import Base
@@ -16,7 +16,12 @@ class StatusType(enum.Enum):
 
 class EmailData(Base):
     __tablename__ = "email_data"
-    __table_args__ = {"schema": "emails"}
+    __table_args__ = (
+        Index("ix_email_data_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_email_data_status_updated_at", "status", "updated_at"),
+        Index("ux_email_data_idempotency_key", "idempotency_key", unique=True),
+        {"schema": "emails"},
+    )
 
     id = Column(Integer, primary_key=True)
     address = Column(String(255))
@@ -25,7 +30,15 @@ class EmailData(Base):
     template = Column(String(255), nullable=True)
     context = Column(JSONB, nullable=True)
     body = Column(Text, nullable=True)
+    body_hash = Column(String(64), ForeignKey("emails.email_body.hash"), nullable=True)
     status = Column(Enum(StatusType, schema="emails"), default=StatusType.NEW)
     attachments = Column(JSONB, nullable=True)
     created_at = Column(DateTime, server_default="now()")
+    # Обновляется при каждой смене статуса: по нему находятся строки, зависшие после падения процесса
+    updated_at = Column(DateTime, server_default="now()", onupdate=func.now())
     error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # Сколько раз сервер ответил 421/451: такие откладывания не тратят попытки, но их число ограничено
+    deferrals = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime, nullable=True)
+    idempotency_key = Column(String(255), nullable=True)
@@ -1,11 +1,13 @@
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
 from src.app_logger import app_logger
 from src.settings.postgres import PostgresSettings
+from src.settings.prometheus import PrometheusMetrics
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -17,7 +19,7 @@ class SessionManager:
         self.settings = settings
         app_logger.info("Подключение к Postgres начато")
         app_logger.debug(self.settings.model_dump_json(indent=4))
-        _engine = create_async_engine(
+        self._engine = create_async_engine(
             self.settings.dsn,
             echo=self.settings.echo,
             pool_size=self.settings.pool_size,
@@ -26,15 +28,18 @@ class SessionManager:
             pool_timeout=self.settings.pool_timeout,
             pool_pre_ping=self.settings.pool_pre_ping,
         )
+        checked_out = PrometheusMetrics.db_pool_checked_out
+        event.listen(self._engine.sync_engine.pool, "checkout", lambda *_: checked_out.inc())
+        event.listen(self._engine.sync_engine.pool, "checkin", lambda *_: checked_out.dec())
         self._async_session = async_sessionmaker(
-            bind=_engine,
+            bind=self._engine,
             autocommit = self.settings.autocommit,
         )
         app_logger.info("Подключение к Postgres установлено")
 
     @asynccontextmanager
     async def __call__(self) -> AsyncGenerator[AsyncSession, None]:
-        app_logger.info("Создание сессии Postgres")
+        app_logger.debug("Создание сессии Postgres")
         session = self._async_session()
         try:
             yield session
@@ -44,4 +49,8 @@ class SessionManager:
             raise
         finally:
             await session.close()
-        app_logger.info("Сессия Postgres закрыта")
+        app_logger.debug("Сессия Postgres закрыта")
+
+    async def close(self) -> None:
+        await self._engine.dispose()
+        app_logger.info("Подключение к Postgres закрыто")
@@ -1,37 +1,94 @@
 import asyncio
 import ssl
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import Annotated, Any, AsyncGenerator
 
 import aio_pika
 import orjson
 from aiormq import AMQPError
-from pydantic import BaseModel
+from aiormq.exceptions import AMQPChannelError, AMQPConnectionError, ChannelInvalidStateError, ChannelNotFoundEntity
+from pydantic import AfterValidator, BaseModel, Discriminator, Field, Tag, TypeAdapter
 
 from src.app_logger import app_logger
+from src.settings.prometheus import PrometheusMetrics
 from src.settings.rabbit import RabbitSettings
 
+CONNECTION_ERRORS = (AMQPConnectionError, AMQPChannelError, ChannelInvalidStateError, ConnectionError)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """Переподключение нужно только при ошибках соединения или канала, а не при ошибках обработки."""
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+class RabbitReadError(AMQPError):
+    pass
+
 
 class RabbitMessageMeta(BaseModel):
     exchange: str | None = None
     routing_key: str | None = None
     delivery_tag: int | None = None
+    message_id: str | None = None
 
     def __str__(self) -> str:
         return f"Exchange: {self.exchange}, Routing Key: {self.routing_key}, Delivery Tag: {self.delivery_tag}"
 
 
+def _check_address(value: str) -> str:
+    # Адрес попадает в RCPT TO:<...> и в заголовок To: проверка до вставки строк в email_data
+    if not value.strip() or any(char in value for char in "\r\n<>"):
+        raise ValueError(f"Некорректный адрес получателя: {value!r}")
+    return value
+
+
+Address = Annotated[str, AfterValidator(_check_address)]
+
+
 class EmailMessage(BaseModel):
-    to: str
+    to: Address
+    subject: str
+    message: str | None = None
+    template: str | None = None
+    context: dict | None = None
+    attachments: list | None = None
+    # Колонка email_data.idempotency_key - String(255)
+    idempotency_key: str | None = Field(default=None, max_length=255)
+
+
+class BulkRecipient(BaseModel):
+    to: Address
+    context: dict | None = None
+
+
+class BulkEmailMessage(BaseModel):
+    """Одно сообщение на много получателей: общий шаблон и контекст, у получателя - свои поля контекста."""
+
     subject: str
     message: str | None = None
     template: str | None = None
     context: dict | None = None
     attachments: list | None = None
+    idempotency_key: str | None = Field(default=None, max_length=255)
+    recipients: list[BulkRecipient]
+
+
+def _payload_kind(payload: Any) -> str:
+    if isinstance(payload, dict):
+        return "bulk" if "recipients" in payload else "single"
+    return "bulk" if isinstance(payload, BulkEmailMessage) else "single"
+
+
+# Тип сообщения выбирается по наличию recipients, валидатор не перебирает варианты объединения
+EmailPayload = Annotated[
+    Annotated[EmailMessage, Tag("single")] | Annotated[BulkEmailMessage, Tag("bulk")],
+    Discriminator(_payload_kind),
+]
+payload_adapter = TypeAdapter(EmailPayload)
 
 
 class MessageInfo(BaseModel):
-    message: EmailMessage
+    message: EmailPayload
     message_meta: RabbitMessageMeta
 
 
@@ -42,6 +99,56 @@ class RabbitConnection:
         self.channel: aio_pika.abc.AbstractRobustChannel | None = None
         self.queue: aio_pika.abc.AbstractRobustQueue | None = None
         self.exchange: aio_pika.abc.AbstractRobustExchange | None = None
+        self._topology_declared = False
+
+    async def _declare_topology(self) -> None:
+        if self.settings.exchange:
+            self.exchange = await self.channel.declare_exchange(
+                name=self.settings.exchange.name,
+                type=self.settings.exchange.type,
+                durable=self.settings.exchange.durable,
+                auto_delete=self.settings.exchange.auto_delete,
+            )
+
+        self.queue = await self.channel.declare_queue(
+            name=self.settings.queue.name,
+            durable=self.settings.queue.durable,
+            exclusive=self.settings.queue.exclusive,
+            auto_delete=self.settings.queue.auto_delete,
+            arguments={
+                "x-message-ttl": self.settings.queue.x_message_ttl,
+                "x-dead-letter-exchange": self.settings.queue.dead_letter_exchange,
+                "x-dead-letter-routing-key": self.settings.queue.dead_letter_routing_key,
+            },
+        )
+
+        if self.exchange:
+            for binding in self.settings.bindings:
+                await self.queue.bind(
+                    exchange=self.exchange,
+                    routing_key=binding.routing_key,
+                    arguments=binding.arguments,
+                )
+        self._topology_declared = True
+
+    async def _open_channel(self) -> None:
+        self.channel = await self.connection.channel()
+        await self.channel.set_qos(prefetch_count=self.settings.prefetch_count)
+
+    async def _attach_topology(self) -> None:
+        # Обменник, очередь и привязки уже объявлены этим процессом: пассивная проверка вместо объявления
+        # с аргументами и привязками. Если брокер их потерял (перезапуск, auto_delete), объявляем заново
+        try:
+            if self.settings.exchange:
+                self.exchange = await self.channel.get_exchange(self.settings.exchange.name)
+            self.queue = await self.channel.get_queue(self.settings.queue.name)
+        except ChannelNotFoundEntity as e:
+            app_logger.warning(f"Топология RabbitMQ не найдена после переподключения, объявляется заново: {e}")
+            # Брокер закрывает канал после неудачной пассивной проверки
+            if not self.channel.is_closed:
+                await self.channel.close()
+            await self._open_channel()
+            await self._declare_topology()
 
     async def connect(self) -> None:
         app_logger.info("Подключение к RabbitMQ")
@@ -63,36 +170,12 @@ class RabbitConnection:
                 ssl_context=context,
             )
 
-            self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=self.settings.prefetch_count)
+            await self._open_channel()
 
-            if self.settings.exchange:
-                self.exchange = await self.channel.declare_exchange(
-                    name=self.settings.exchange.name,
-                    type=self.settings.exchange.type,
-                    durable=self.settings.exchange.durable,
-                    auto_delete=self.settings.exchange.auto_delete,
-                )
-
-            self.queue = await self.channel.declare_queue(
-                name=self.settings.queue.name,
-                durable=self.settings.queue.durable,
-                exclusive=self.settings.queue.exclusive,
-                auto_delete=self.settings.queue.auto_delete,
-                arguments={
-                    "x-message-ttl": self.settings.queue.x_message_ttl,
-                    "x-dead-letter-exchange": self.settings.queue.dead_letter_exchange,
-                    "x-dead-letter-routing-key": self.settings.queue.dead_letter_routing_key,
-                },
-            )
-
-            if self.exchange:
-                for binding in self.settings.bindings:
-                    await self.queue.bind(
-                        exchange=self.exchange,
-                        routing_key=binding.routing_key,
-                        arguments=binding.arguments,
-                    )
+            if self._topology_declared:
+                await self._attach_topology()
+            else:
+                await self._declare_topology()
 
             app_logger.info("Подключение к RabbitMQ установлено")
         except Exception as e:
@@ -111,23 +194,160 @@ class RabbitConnection:
         app_logger.info("Подключение к RabbitMQ закрыто")
 
 
+class AckAggregator:
+    """Подтверждает сообщения пачками через ack(multiple=True).
+
+    Для каждого канала хранятся выданные delivery tag. Подтвержденный обработчиком tag
+    ждет сброса; при сбросе непрерывный префикс подтвержденных tag'ов подтверждается
+    одним ack(multiple=True) по последнему из них, остальные - по одному. Nack всегда
+    отправляется сразу и только для своего сообщения.
+    """
+
+    def __init__(self, batch_size: int, max_delay: float) -> None:
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        # tag -> None, пока сообщение в обработке, или само сообщение, когда оно ждет ack
+        self._pending: dict[aio_pika.abc.AbstractChannel, dict[int, aio_pika.IncomingMessage | None]] = {}
+        self._acked = 0
+        self._timer: asyncio.Task | None = None
+        # Сброс по таймеру и по размеру пачки не должны подтверждать одни и те же tag'и одновременно
+        self._flush_lock = asyncio.Lock()
+
+    def track(self, message: aio_pika.IncomingMessage) -> None:
+        self._pending.setdefault(message.channel, {})[message.delivery_tag] = None
+
+    def discard(self, message: aio_pika.IncomingMessage) -> None:
+        tags = self._pending.get(message.channel)
+        if tags is not None:
+            tags.pop(message.delivery_tag, None)
+
+    async def ack(self, message: aio_pika.IncomingMessage) -> None:
+        self._pending.setdefault(message.channel, {})[message.delivery_tag] = message
+        self._acked += 1
+        if self._acked >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def nack(self, message: aio_pika.IncomingMessage, requeue: bool = False) -> None:
+        self.discard(message)
+        if not message.channel.is_closed:
+            await message.nack(requeue=requeue)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            app_logger.error(f"ACK error: {e}")
+
+    async def flush(self) -> None:
+        self._acked = 0
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        async with self._flush_lock:
+            for channel in list(self._pending):
+                await self._flush_channel(channel)
+
+    async def _flush_channel(self, channel: aio_pika.abc.AbstractChannel) -> None:
+        tags = self._pending.get(channel)
+        if tags is None:
+            return
+        if channel.is_closed:
+            # Неподтвержденные сообщения закрытого канала брокер передоставит сам
+            self._pending.pop(channel, None)
+            return
+
+        last_contiguous = None
+        for tag in sorted(tags):
+            if tags[tag] is None:
+                break
+            last_contiguous = tags.pop(tag, None)
+        if last_contiguous is not None:
+            await last_contiguous.ack(multiple=True)
+        for tag in [tag for tag, message in tags.items() if message is not None]:
+            message = tags.pop(tag, None)
+            if message is not None:
+                await message.ack()
+        if not tags:
+            self._pending.pop(channel, None)
+
+
 class RabbitReader:
     def __init__(self, settings: RabbitSettings) -> None:
         self.settings = settings
         self.max_retries = settings.max_retries
         self.retry_delay_seconds = settings.retry_delay_seconds
         self._connection_manager = RabbitConnection(settings)
+        self._lock = asyncio.Lock()
+        # None в буфере будит обработчиков, ждущих сообщение, при остановке чтения
+        self._buffer: asyncio.Queue[aio_pika.IncomingMessage | None] = asyncio.Queue(maxsize=settings.prefetch_count)
+        self._consumer_tag: str | None = None
+        self._reading_stopped = asyncio.Event()
+        self.acks = AckAggregator(
+            batch_size=min(settings.ack_batch_size, max(1, settings.prefetch_count // 2)),
+            max_delay=settings.ack_max_delay_ms / 1000,
+        )
+
+    @property
+    def streaming(self) -> bool:
+        return self.settings.read_mode == "consume"
 
     async def _get_connection(self) -> RabbitConnection:
-        if not self._connection_manager.connection or not await self._connection_manager.is_connected():
-            await self._connection_manager.connect()
+        async with self._lock:
+            if not self._connection_manager.connection or not await self._connection_manager.is_connected():
+                await self._connection_manager.connect()
+            if self.streaming:
+                await self._start_consuming()
         return self._connection_manager
 
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        self.acks.track(message)
+        await self._buffer.put(message)
+
+    async def _start_consuming(self) -> None:
+        if self._consumer_tag is not None or self._reading_stopped.is_set():
+            return
+        self._consumer_tag = await self._connection_manager.queue.consume(self._on_message)
+        app_logger.info("Подписка на очередь RabbitMQ %s оформлена", self.settings.queue.name)
+
+    async def stop_consuming(self) -> None:
+        consumer_tag, self._consumer_tag = self._consumer_tag, None
+        queue = self._connection_manager.queue
+        if consumer_tag and queue and not queue.channel.is_closed:
+            try:
+                await queue.cancel(consumer_tag)
+            except Exception as e:
+                app_logger.error(f"Ошибка при отмене подписки на очередь RabbitMQ: {e}")
+        # Неподтвержденные сообщения из буфера брокер передоставит после закрытия канала
+        while not self._buffer.empty():
+            if message := self._buffer.get_nowait():
+                self.acks.discard(message)
+
+    async def stop_reading(self) -> None:
+        """Отменяет подписку на очередь и будит обработчиков, ждущих сообщение.
+
+        Следующие чтения сразу возвращают None, уже полученные сообщения можно подтвердить.
+        """
+        self._reading_stopped.set()
+        await self.stop_consuming()
+        while not self._buffer.full():
+            self._buffer.put_nowait(None)
+
     async def reset(self) -> None:
-        await self._connection_manager.close()
-        await self._connection_manager.connect()
+        async with self._lock:
+            await self.stop_consuming()
+            await self.acks.flush()
+            await self._connection_manager.close()
+            await self._connection_manager.connect()
+            if self.streaming:
+                await self._start_consuming()
 
     async def close(self) -> None:
+        await self.stop_consuming()
+        await self.acks.flush()
         await self._connection_manager.close()
 
     @staticmethod
@@ -136,15 +356,37 @@ class RabbitReader:
             exchange=rabbit_message.exchange,
             routing_key=rabbit_message.routing_key,
             delivery_tag=rabbit_message.delivery_tag,
+            message_id=rabbit_message.message_id,
         )
         try:
-            message = orjson.loads(rabbit_message.body.decode())
+            # orjson читает bytes напрямую, без копии через decode()
+            payload = orjson.loads(rabbit_message.body)
         except orjson.JSONDecodeError:
             app_logger.error(f"Ошибка при декодирования сообщения из RabbitMQ. {message_meta}")
             return None
-        return MessageInfo(message=EmailMessage(**message), message_meta=message_meta)
+        return MessageInfo(message=payload_adapter.validate_python(payload), message_meta=message_meta)
+
+    async def _read_buffer(self) -> aio_pika.IncomingMessage | None:
+        await self._get_connection()
+        try:
+            message = await asyncio.wait_for(self._buffer.get(), timeout=self.settings.timeout_seconds)
+        except asyncio.TimeoutError:
+            return None
+        if message is None or message.channel.is_closed:
+            return None
+        if self._reading_stopped.is_set():
+            # Пришло уже после отмены подписки: брокер передоставит его после закрытия канала
+            self.acks.discard(message)
+            return None
+        app_logger.info("Получено сообщение из RabbitMQ")
+        return message
 
     async def read(self) -> aio_pika.IncomingMessage | None:
+        if self._reading_stopped.is_set():
+            return None
+        if self.streaming:
+            return await self._read_buffer()
+
         start_time = asyncio.get_running_loop().time()
         timeout = self.settings.timeout_seconds
         elapsed = asyncio.get_running_loop().time() - start_time
@@ -153,46 +395,46 @@ class RabbitReader:
             return None
 
         conn = await self._get_connection()
+        get = asyncio.ensure_future(conn.queue.get(fail=True, timeout=remaining_time))
+        stopped = asyncio.ensure_future(self._reading_stopped.wait())
         try:
-            message = await conn.queue.get(fail=True, timeout=remaining_time)
+            # stop_reading прерывает ожидание: остановка не ждет таймаут чтения
+            done, _ = await asyncio.wait([get, stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopped.cancel()
+            if not get.done():
+                get.cancel()
+        if get not in done:
+            # Сообщение, выданное брокером уже после отмены, он передоставит после закрытия канала
+            return None
+        try:
+            message = get.result()
             if message:
+                self.acks.track(message)
                 app_logger.info("Получено сообщение из RabbitMQ")
             return message
         except (asyncio.TimeoutError, asyncio.QueueEmpty):
             return None
 
 
-@asynccontextmanager
-async def get_rabbit_processor(
-    settings: RabbitSettings,
-) -> AsyncGenerator["RabbitMessageProcessor", None]:
-    reader = RabbitReader(settings)
-    processor = RabbitMessageProcessor(reader)
-    try:
-        yield processor
-    finally:
-        await processor.close()
-
-
 class RabbitMessageProcessor:
     def __init__(self, rabbit_reader: RabbitReader):
         self.reader = rabbit_reader
-        self.messages: list[aio_pika.IncomingMessage] = []
 
-    async def __aenter__(self) -> MessageInfo | None:
+    @property
+    def streaming(self) -> bool:
+        return self.reader.streaming
+
+    async def _read(self) -> aio_pika.IncomingMessage | None:
         max_retries = self.reader.settings.max_retries
         retry_delay = self.reader.settings.retry_delay_seconds
 
         for attempt in range(max_retries):
-            self._msg = None
             try:
                 raw_msg = await self.reader.read()
-                if not raw_msg:
-                    if attempt > 0:
-                        app_logger.info("Очередь RabbitMQ пуста")
-                    return None
-                self._msg = raw_msg
-                return await self.reader.decode_message(raw_msg)
+                if not raw_msg and attempt > 0:
+                    app_logger.info("Очередь RabbitMQ пуста")
+                return raw_msg
             except Exception as e:
                 if attempt < max_retries - 1:
                     app_logger.error(
@@ -200,34 +442,53 @@ class RabbitMessageProcessor:
                         f"Попытка повторного чтения: {attempt + 1}/{max_retries}. Ошибка: {e}"
                     )
                     await asyncio.sleep(retry_delay * (2**attempt))
-                    await self.reader.reset()
+                    if is_connection_error(e):
+                        await self.reader.reset()
                 else:
                     app_logger.error(f"Ошибка при чтении из RabbitMQ: {e}")
-                    raise
-        raise AMQPError("Ошибка при чтении из RabbitMQ после нескольких попыток")
-
-    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
-        if not self._msg:
+                    raise RabbitReadError(f"Ошибка при чтении из RabbitMQ: {e}") from e
+        raise RabbitReadError("Ошибка при чтении из RabbitMQ после нескольких попыток")
+
+    @asynccontextmanager
+    async def __call__(self) -> AsyncGenerator[MessageInfo | None, None]:
+        """Читает одно сообщение и подтверждает его после выхода из блока.
+
+        Состояние сообщения не хранится в процессоре, поэтому несколько обработчиков
+        могут использовать один процессор одновременно.
+        """
+        stage_duration = PrometheusMetrics.stage_duration
+        with stage_duration.labels(stage="receive").time():
+            raw_msg = await self._read()
+        if not raw_msg:
+            yield None
             return
-        if exc_type:
-            await self._nack(self._msg)
-            await self.reader.reset()
+        try:
+            with stage_duration.labels(stage="decode").time():
+                message_info = await self.reader.decode_message(raw_msg)
+            yield message_info
+        except Exception as e:
+            await self._nack(raw_msg)
+            if is_connection_error(e):
+                await self.reader.reset()
+            raise
         else:
-            await self._ack(self._msg)
+            await self._ack(raw_msg)
 
     async def _ack(self, raw_message: aio_pika.IncomingMessage) -> None:
         try:
-            if not raw_message.channel.is_closed:
-                await raw_message.ack()
+            with PrometheusMetrics.stage_duration.labels(stage="ack").time():
+                await self.reader.acks.ack(raw_message)
         except Exception as e:
             app_logger.error(f"ACK error: {e}")
 
     async def _nack(self, raw_message: aio_pika.IncomingMessage) -> None:
         try:
-            if not raw_message.channel.is_closed:
-                await raw_message.nack(requeue=False)
+            await self.reader.acks.nack(raw_message, requeue=False)
         except Exception as e:
             app_logger.error(f"NACK error: {e}")
 
+    async def stop_reading(self) -> None:
+        await self.reader.stop_reading()
+
     async def close(self) -> None:
         await self.reader.close()
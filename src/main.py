@@ -1,18 +1,50 @@
 import asyncio
+import signal
+
+from prometheus_client import start_http_server
 
 from src.app_logger import app_logger
 from src.database.postgres import SessionManager
-from src.database.rabbit import get_rabbit_processor
+from src.database.rabbit import RabbitMessageProcessor, RabbitReader
+from src.service.renderer import render_engine, warm_up_templates
 from src.service.service import Service
+from src.service.smtp_pool import async_smtp_pool, smtp_pool
 from src.settings.app import settings
 
 
+async def shutdown(session_manager: SessionManager, rabbit_processor: RabbitMessageProcessor) -> None:
+    """Закрывает соединения одновременно: QUIT каждого SMTP соединения может ждать до smtp_timeout."""
+    render_engine.close()
+    await asyncio.gather(
+        rabbit_processor.close(),
+        async_smtp_pool.close(),
+        asyncio.to_thread(smtp_pool.close),
+        session_manager.close(),
+    )
+
+
 async def main():
     app_logger.info("Запуск сервиса")
+    warm_up_templates()
+    if settings.prometheus.enabled:
+        start_http_server(settings.prometheus.port)
+        app_logger.info(f"Метрики Prometheus доступны на порту {settings.prometheus.port}")
     session_manager = SessionManager(settings.postgres)
-    async with get_rabbit_processor(settings.rabbit) as rabbit_processor:
-        await Service(session_manager, rabbit_processor).run()
-
+    rabbit_processor = RabbitMessageProcessor(RabbitReader(settings.rabbit))
+    try:
+        service = Service(session_manager, rabbit_processor)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, service.stop)
+        await service.run()
+    finally:
+        # Один срок на закрытие всех соединений: недоступный брокер или SMTP сервер не держит остановку
+        try:
+            async with asyncio.timeout(settings.shutdown_timeout):
+                await shutdown(session_manager, rabbit_processor)
+        except TimeoutError:
+            app_logger.warning(f"Соединения не закрылись за {settings.shutdown_timeout} с, остановка без ожидания")
+    app_logger.info("Сервис остановлен")
 
 if __name__ == "__main__":
     asyncio.run(main())
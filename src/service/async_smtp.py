@@ -0,0 +1,217 @@
+import asyncio
+import base64
+import smtplib
+import socket
+import ssl
+from contextlib import suppress
+from email.message import EmailMessage
+from email.utils import getaddresses
+from typing import Iterator
+
+from src.service.mime_writer import CRLF, PreparedMessage, StreamingMessage, quote_data
+
+_local_hostname: str | None = None
+
+
+async def local_hostname() -> str:
+    """Имя для EHLO. getfqdn делает блокирующий обратный DNS запрос, поэтому он выполняется
+    один раз на процесс и в потоке, а не в event loop при каждом подключении."""
+    global _local_hostname
+    if _local_hostname is None:
+        _local_hostname = await asyncio.to_thread(socket.getfqdn)
+    return _local_hostname
+
+
+async def _wait_uncancelled(task: asyncio.Task) -> None:
+    """Дожидается task, не прерываясь повторной отменой: вызывающий уже обрабатывает первую."""
+    while not task.done():
+        with suppress(asyncio.CancelledError):
+            await asyncio.wait([task])
+    if not task.cancelled():
+        # Ошибка куска уже не нужна, но должна быть прочитана, иначе asyncio запишет ее в лог
+        task.exception()
+
+
+class AsyncSMTP:
+    """Минимальный SMTP клиент на asyncio streams: EHLO, STARTTLS, AUTH PLAIN/LOGIN, отправка писем.
+
+    Ошибки поднимаются теми же исключениями smtplib, что и у синхронного клиента.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float, ssl_context: ssl.SSLContext | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.esmtp_features: dict[str, str] = {}
+        # Текущая транзакция дошла до DATA: после разрыва уже нельзя считать, что письмо не принято
+        self.data_started = False
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            timeout=self.timeout,
+        )
+        code, msg = await self._read_reply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, msg)
+        await self.ehlo()
+
+    async def _read_reply(self) -> tuple[int, str]:
+        if self._reader is None:
+            raise smtplib.SMTPServerDisconnected("Соединение с SMTP сервером не установлено")
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), timeout=self.timeout)
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("SMTP сервер закрыл соединение")
+            lines.append(line[4:].strip().decode(errors="replace"))
+            try:
+                code = int(line[:3])
+            except ValueError:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(f"Некорректный ответ SMTP сервера: {line!r}") from None
+            if line[3:4] != b"-":
+                return code, "\n".join(lines)
+
+    async def _write(self, data: bytes) -> None:
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected("Соединение с SMTP сервером не установлено")
+        self._writer.write(data)
+        await asyncio.wait_for(self._writer.drain(), timeout=self.timeout)
+
+    async def execute(self, command: str) -> tuple[int, str]:
+        # Как smtplib.SMTP.putcmd: перевод строки в адресе или аргументе превратил бы его в еще одну команду
+        if "\r" in command or "\n" in command:
+            raise ValueError("Команда SMTP не может содержать символы CR и LF")
+        await self._write(command.encode() + CRLF)
+        return await self._read_reply()
+
+    async def ehlo(self) -> None:
+        code, msg = await self.execute(f"EHLO {await local_hostname()}")
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, msg)
+        self.esmtp_features = {}
+        for line in msg.split("\n")[1:]:
+            keyword, _, params = line.partition(" ")
+            self.esmtp_features[keyword.lower()] = params
+
+    async def starttls(self) -> None:
+        if "starttls" not in self.esmtp_features:
+            raise smtplib.SMTPNotSupportedError("SMTP сервер не поддерживает STARTTLS")
+        code, msg = await self.execute("STARTTLS")
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, msg)
+        await self._writer.start_tls(self.ssl_context, server_hostname=self.host)
+        await self.ehlo()
+
+    async def login(self, user: str, password: str) -> None:
+        mechanisms = self.esmtp_features.get("auth", "").upper().split()
+        if "PLAIN" in mechanisms:
+            token = base64.b64encode(f"\0{user}\0{password}".encode()).decode()
+            code, msg = await self.execute(f"AUTH PLAIN {token}")
+        elif "LOGIN" in mechanisms:
+            code, msg = await self.execute("AUTH LOGIN")
+            if code == 334:
+                code, msg = await self.execute(base64.b64encode(user.encode()).decode())
+            if code == 334:
+                code, msg = await self.execute(base64.b64encode(password.encode()).decode())
+        else:
+            raise smtplib.SMTPNotSupportedError("SMTP сервер не поддерживает AUTH PLAIN/LOGIN")
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, msg)
+
+    async def noop(self) -> tuple[int, str]:
+        return await self.execute("NOOP")
+
+    async def rset(self) -> tuple[int, str]:
+        return await self.execute("RSET")
+
+    async def _write_chunks(self, chunks: Iterator[bytes]) -> None:
+        pending: asyncio.Task | None = None
+        try:
+            while True:
+                # Куски готовятся в потоке: чтение вложений из хранилища и base64 не блокируют event loop.
+                # shield: при отмене next() в потоке продолжается, и генератор нельзя закрыть до его конца
+                pending = asyncio.ensure_future(asyncio.to_thread(next, chunks, None))
+                chunk = await asyncio.shield(pending)
+                if chunk is None:
+                    break
+                await self._write(chunk)
+        finally:
+            if pending is not None and not pending.done():
+                await _wait_uncancelled(pending)
+            chunks.close()
+        await self._write(b"." + CRLF)
+
+    async def sendmail(
+            self,
+            from_addr: str,
+            to_addrs: list[str],
+            data: bytes | Iterator[bytes],
+    ) -> dict[str, tuple[int, str]]:
+        """data - письмо целиком или генератор кусков, уже подготовленных для DATA (см. StreamingMessage)."""
+        self.data_started = False
+        code, msg = await self.execute(f"MAIL FROM:<{from_addr}>")
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, msg, from_addr)
+
+        refused = {}
+        for addr in to_addrs:
+            code, msg = await self.execute(f"RCPT TO:<{addr}>")
+            if code not in (250, 251):
+                refused[addr] = (code, msg)
+        if len(refused) == len(to_addrs):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        self.data_started = True
+        code, msg = await self.execute("DATA")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, msg)
+        if isinstance(data, bytes):
+            await self._write(quote_data(data) + b"." + CRLF)
+        else:
+            await self._write_chunks(data)
+        code, msg = await self._read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, msg)
+        return refused
+
+    async def send_message(
+            self,
+            msg: EmailMessage | StreamingMessage | PreparedMessage,
+            to_addrs: list[str] | None = None,
+    ) -> dict[str, tuple[int, str]]:
+        if isinstance(msg, PreparedMessage):
+            return await self.sendmail(msg.from_addr, to_addrs, msg.data)
+        headers = msg if isinstance(msg, EmailMessage) else msg.headers
+        from_addr = getaddresses([headers["Sender"] or headers["From"]])[0][1]
+        if to_addrs is None:
+            to_addrs = [addr for _, addr in getaddresses(headers.get_all("To", []) + headers.get_all("Cc", []))]
+        if isinstance(msg, EmailMessage):
+            data = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+        else:
+            data = msg.chunks()
+        return await self.sendmail(from_addr, to_addrs, data)
+
+    async def quit(self) -> None:
+        try:
+            await self.execute("QUIT")
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
@@ -0,0 +1,193 @@
+import abc
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator
+
+from src.app_logger import app_logger
+from src.settings.app import Settings, settings
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def checked_digest(digest: str) -> str:
+    """Ссылка на вложение становится путем или ключом S3, поэтому принимается только SHA-256 в hex."""
+    if not isinstance(digest, str) or not _DIGEST.fullmatch(digest):
+        raise ValueError(f"Некорректная ссылка на вложение: {digest!r}")
+    return digest
+
+
+class AttachmentStore(abc.ABC):
+    """Хранилище вложений с адресацией по SHA-256: одинаковые файлы хранятся один раз.
+
+    В email_data вместо содержимого пишется ссылка {"filename", "sha256", "size"},
+    байты читаются из хранилища только при сборке письма.
+    """
+
+    def __init__(self, max_known: int = 10000) -> None:
+        self.max_known = max_known
+        self._known: OrderedDict[str, None] = OrderedDict()
+
+    @abc.abstractmethod
+    def exists(self, digest: str) -> bool: ...
+
+    @abc.abstractmethod
+    def write(self, digest: str, data: bytes) -> None: ...
+
+    @abc.abstractmethod
+    def read(self, digest: str) -> bytes: ...
+
+    def chunks(self, digest: str, size: int) -> Iterator[bytes | memoryview]:
+        """Содержимое кусками примерно по size байт, чтобы большое вложение не читалось в память целиком."""
+        yield self.read(digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._known and not self.exists(digest):
+            self.write(digest, data)
+        self._known[digest] = None
+        self._known.move_to_end(digest)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+        return digest
+
+    def store(self, attachments: list[dict]) -> list[dict]:
+        """Переносит содержимое вложений из base64 в хранилище и возвращает ссылки.
+
+        Ссылки из входящего сообщения не принимаются: хеш всегда считается по содержимому.
+        """
+        refs = []
+        for attachment in attachments:
+            data = base64.b64decode(attachment["content"])
+            refs.append({"filename": attachment["filename"], "sha256": self.put(data), "size": len(data)})
+        return refs
+
+
+class FileSystemAttachmentStore(AttachmentStore):
+    def __init__(self, root: str) -> None:
+        super().__init__()
+        self.root = Path(root)
+
+    def _path(self, digest: str) -> Path:
+        digest = checked_digest(digest)
+        return self.root / digest[:2] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self._path(digest).exists()
+
+    def write(self, digest: str, data: bytes) -> None:
+        path = self._path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Запись во временный файл и переименование: читатели не увидят недописанный файл
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{digest}.")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def read(self, digest: str) -> bytes:
+        return self._path(digest).read_bytes()
+
+    def chunks(self, digest: str, size: int) -> Iterator[memoryview]:
+        # Один буфер на все чтения: кусок действителен до следующей итерации
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        with open(self._path(digest), "rb", buffering=0) as file:
+            while read := file.readinto(buffer):
+                yield view[:read]
+
+
+class S3AttachmentStore(AttachmentStore):
+    def __init__(self, bucket: str, prefix: str, endpoint_url: str | None = None) -> None:
+        super().__init__()
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("Для attachment_storage=s3 нужен пакет boto3") from None
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}{checked_digest(digest)}"
+
+    def exists(self, digest: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def write(self, digest: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(digest), Body=data)
+
+    def read(self, digest: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(digest))["Body"].read()
+
+    def chunks(self, digest: str, size: int) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(digest))["Body"]
+        try:
+            yield from body.iter_chunks(size)
+        finally:
+            body.close()
+
+
+def create_attachment_store(settings: Settings) -> AttachmentStore | None:
+    if settings.attachment_storage == "filesystem":
+        return FileSystemAttachmentStore(settings.attachments_dir)
+    if settings.attachment_storage == "s3":
+        if not settings.attachments_s3_bucket:
+            raise ValueError("Для attachment_storage=s3 нужно указать attachments_s3_bucket")
+        return S3AttachmentStore(
+            settings.attachments_s3_bucket,
+            settings.attachments_s3_prefix,
+            settings.attachments_s3_endpoint_url,
+        )
+    return None
+
+
+attachment_store = create_attachment_store(settings)
+
+
+async def store_attachments(attachments: list | None) -> list | None:
+    """Заменяет вложения сообщения ссылками на хранилище, если оно включено."""
+    if not attachments or attachment_store is None:
+        return attachments
+    refs = await asyncio.to_thread(attachment_store.store, attachments)
+    app_logger.debug("Вложения сохранены в хранилище: %s", ", ".join(ref["sha256"][:12] for ref in refs))
+    return refs
+
+
+_BASE64 = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+
+
+def _inline_chunks(content: str, size: int) -> Iterator[bytes]:
+    if not _BASE64.fullmatch(content):
+        # Переносы строк и прочие символы вне алфавита b64decode пропускает, делить такую строку нельзя
+        yield base64.b64decode(content)
+        return
+    step = size // 3 * 4
+    for start in range(0, len(content), step):
+        yield base64.b64decode(content[start:start + step])
+
+
+def attachment_chunks(attachment: dict, size: int) -> Iterator[bytes | memoryview]:
+    """Содержимое вложения кусками: base64 из строки декодируется по частям, хранилище читается потоком."""
+    if "sha256" not in attachment:
+        return _inline_chunks(attachment["content"], size)
+    if attachment_store is None:
+        raise RuntimeError("Вложение хранится по ссылке, но хранилище вложений не настроено")
+    return attachment_store.chunks(attachment["sha256"], size)
+
@@ -1,111 +1,347 @@
 import asyncio
-import base64
-import mimetypes
 import smtplib
-from email.message import EmailMessage
+from contextlib import asynccontextmanager, suppress
+from datetime import timedelta
+from typing import NamedTuple
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Row, func, select, update
 
-from src.app_logger import app_logger
+from src.app_logger import app_logger, log_context
+from src.database.batch_writer import EmailDataBatchWriter
+from src.database.models.email_body import EmailBody
 from src.database.models.email_data import EmailData, StatusType
+from src.database.postgres import SessionManager
+from src.service.message_assembly import assemble_message, envelope_recipients
+from src.service.rate_limiter import rate_limiter, recipient_domain
+from src.service.smtp_pool import async_smtp_pool, smtp_pool
 from src.settings.app import settings
 
 
 def _send_email(
-        to: str,
+        to: str | list[str],
         subject: str,
         message: str | None,
         body: str | None,
         attachments: list | None,
+) -> dict[str, tuple[int, bytes | str]]:
+    msg = assemble_message(to, subject, message, body, attachments)
+    return smtp_pool.send_message(msg, envelope_recipients(to))
+
+
+async def _send_email_async(
+        to: str | list[str],
+        subject: str,
+        message: str | None,
+        body: str | None,
+        attachments: list | None,
+) -> dict[str, tuple[int, bytes | str]]:
+    msg = assemble_message(to, subject, message, body, attachments)
+    return await async_smtp_pool.send_message(msg, envelope_recipients(to))
+
+
+async def send_email(
+        to: str | list[str],
+        subject: str,
+        message: str | None,
+        body: str | None,
+        attachments: list | None,
+) -> dict[str, tuple[int, bytes | str]]:
+    """Отправляет письмо и возвращает получателей, отклоненных сервером, если приняты не все."""
+    if settings.smtp_transport == "asyncio":
+        return await _send_email_async(to, subject, message, body, attachments)
+    return await asyncio.to_thread(_send_email, to, subject, message, body, attachments)
+
+
+class OutgoingEmail(NamedTuple):
+    id: int
+    address: str
+    subject: str
+    message: str | None
+    body: str | None
+    attachments: list | None
+    attempts: int = 0
+    deferrals: int = 0
+
+
+EMAIL_SEND_COLUMNS = (
+    EmailData.id,
+    EmailData.address,
+    EmailData.subject,
+    EmailData.message,
+    # В режиме body_storage=shared тело лежит в email_body, в строке только хеш
+    func.coalesce(
+        EmailData.body,
+        select(EmailBody.body).where(EmailBody.hash == EmailData.body_hash).scalar_subquery(),
+    ).label("body"),
+    EmailData.attachments,
+    EmailData.attempts,
+    EmailData.deferrals,
+)
+
+
+async def claim_email(session_manager: SessionManager, email_id: int) -> Row | None:
+    """Переводит письмо в PROCESSING и возвращает данные для отправки, если его еще никто не взял."""
+    async with session_manager() as session:
+        result = await session.execute(
+            update(EmailData)
+            .where(EmailData.id == email_id, EmailData.status == StatusType.NEW)
+            .values(status=StatusType.PROCESSING, error=None)
+            .returning(*EMAIL_SEND_COLUMNS)
+        )
+        return result.one_or_none()
+
+
+def _ids_filter(email_id: int | list[int]):
+    if isinstance(email_id, int):
+        return EmailData.id == email_id
+    return EmailData.id.in_(email_id)
+
+
+def count_status(status: StatusType, email_id: int | list[int]) -> None:
+    count = 1 if isinstance(email_id, int) else len(email_id)
+    settings.prometheus.metrics.emails_status.labels(status=status.value).inc(count)
+
+
+async def set_email_status(
+        session_manager: SessionManager,
+        email_id: int | list[int],
+        status: StatusType,
+        error: str | None = None,
+        writer: EmailDataBatchWriter | None = None,
 ):
-    msg = EmailMessage()
-    msg["From"] = settings.email_from
-    msg["To"] = to
-    msg["Subject"] = subject
-
-    if message:
-        msg.set_content(message)
-    if body:
-        msg.add_alternative(body, subtype="html")
-
-    if attachments:
-        for attachment in attachments:
-            file_data = base64.b64decode(attachment["content"])
-            file_name = attachment["filename"]
-            mime_type, _ = mimetypes.guess_type(file_name)
-            mime_type = mime_type or "application/octet-stream"
-            main_type, sub_type = mime_type.split("/", 1)
-            msg.add_attachment(
-                file_data,
-                maintype=main_type,
-                subtype=sub_type,
-                filename=file_name,
-            )
+    count_status(status, email_id)
+    if writer and isinstance(email_id, int):
+        await writer.update_status(email_id, status, error)
+        return
+    async with session_manager() as session:
+        await session.execute(
+            update(EmailData).where(_ids_filter(email_id)).values(status=status, error=error)
+        )
+
 
-    with smtplib.SMTP(settings.smtp_host, settings.smtp_port) as server:
-        server.starttls()
-        server.login(
-            settings.smtp_user,
-            settings.smtp_password.get_secret_value(),
+async def schedule_retry(session_manager: SessionManager, email_id: int | list[int], attempts: int, error: str):
+    delay = timedelta(seconds=settings.email_retry_delay * (2 ** (attempts - 1)))
+    count_status(StatusType.RETRY, email_id)
+    async with session_manager() as session:
+        await session.execute(
+            update(EmailData)
+            .where(_ids_filter(email_id))
+            .values(
+                status=StatusType.RETRY,
+                error=error,
+                attempts=attempts,
+                next_attempt_at=func.now() + delay,
+            )
         )
-        server.send_message(msg)
 
 
-async def send_email_with_retries(
-        session: AsyncSession,
-        email_id: int,
-        max_retries: int = 3,
-        retry_delay: int = 5
+THROTTLING_CODES = (421, 451)
+
+
+def is_throttling(error: smtplib.SMTPException) -> bool:
+    # 421 в приветствии или на EHLO - сервер недоступен, а не ограничение скорости: это обычная ошибка отправки
+    if isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPHeloError)):
+        return False
+    return getattr(error, "smtp_code", None) in THROTTLING_CODES
+
+
+def throttled_delay(address: str, deferrals: int) -> float:
+    """Задержка после 421/451: не меньше, чем дает ограничение домена, и удваивается с каждым откладыванием."""
+    return max(rate_limiter.throttled(address), settings.email_retry_delay * 2 ** (deferrals - 1))
+
+
+async def defer_email(
+        session_manager: SessionManager,
+        email_id: int | list[int],
+        delay: float,
+        reason: str,
+        throttled: bool = False,
 ):
-    for attempt in range(max_retries + 1):
-        try:
-            record = await session.get(EmailData, email_id, with_for_update=True)
-            if not record:
-                app_logger.error(f"Запись email {email_id} не найдена")
-                return
-
-            if record.status not in {StatusType.NEW, StatusType.RETRY}:
-                app_logger.info(f"Пропуск email {email_id}, статус: {record.status}")
-                return
-
-            record.status = StatusType.PROCESSING
-            record.error = None
-            await session.flush()
-
-            await asyncio.to_thread(
-                _send_email,
-                to=record.address,
-                subject=record.subject,
-                message=record.message,
-                body=record.body,
-                attachments=record.attachments,
+    """Откладывает письмо без траты попытки: ограничение скорости - не ошибка отправки.
+
+    throttled - ответ сервера 421/451, такие откладывания считаются в deferrals.
+    """
+    count_status(StatusType.RETRY, email_id)
+    values = {"deferrals": EmailData.deferrals + 1} if throttled else {}
+    async with session_manager() as session:
+        await session.execute(
+            update(EmailData)
+            .where(_ids_filter(email_id))
+            .values(
+                status=StatusType.RETRY,
+                error=reason,
+                next_attempt_at=func.now() + timedelta(seconds=delay),
+                **values,
             )
+        )
+
+
+async def touch_emails(session_manager: SessionManager, email_ids: list[int]):
+    """Продлевает аренду писем в PROCESSING, чтобы StaleEmailSweeper не вернул их в очередь повторов."""
+    async with session_manager() as session:
+        await session.execute(
+            update(EmailData)
+            .where(EmailData.id.in_(email_ids), EmailData.status == StatusType.PROCESSING)
+            .values(updated_at=func.now())
+        )
+
+
+@asynccontextmanager
+async def lease_heartbeat(session_manager: SessionManager, email_ids: list[int]):
+    """Пока письма в работе, каждую треть processing_lease продлевает их аренду."""
+    async def beat() -> None:
+        while True:
+            await asyncio.sleep(settings.processing_lease / 3)
+            try:
+                await touch_emails(session_manager, email_ids)
+            except Exception as e:
+                app_logger.warning(f"Не удалось продлить аренду писем: {e}")
+
+    task = asyncio.create_task(beat())
+    try:
+        yield
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+async def deliver_email(
+        session_manager: SessionManager,
+        email: Row | OutgoingEmail,
+        writer: EmailDataBatchWriter | None = None,
+):
+    """Одна попытка отправки уже взятого в работу письма.
+
+    При ошибке SMTP повтор не ждет в обработчике, а планируется в базе через next_attempt_at,
+    его подхватит RetryScheduler.
+    """
+    with log_context(email_id=email.id):
+        async with lease_heartbeat(session_manager, [email.id]):
+            await _deliver_email(session_manager, email, writer)
+
+
+async def _deliver_email(
+        session_manager: SessionManager,
+        email: Row | OutgoingEmail,
+        writer: EmailDataBatchWriter | None,
+):
+    delay = await rate_limiter.acquire(email.address)
+    if delay is not None:
+        await defer_email(session_manager, email.id, delay, "Отложено ограничением скорости")
+        app_logger.info("Письмо %s отложено на %.1f с ограничением скорости", email.id, delay)
+        return
 
-            record.status = StatusType.PROCESSED
-            app_logger.info(f"Письмо {email_id} успешно отправлено")
+    attempts = email.attempts + 1
+    try:
+        await send_email(
+            to=email.address,
+            subject=email.subject,
+            message=email.message,
+            body=email.body,
+            attachments=email.attachments,
+        )
+    except smtplib.SMTPException as e:
+        if is_throttling(e) and email.deferrals < settings.email_max_deferrals:
+            delay = throttled_delay(email.address, email.deferrals + 1)
+            await defer_email(session_manager, email.id, delay, str(e), throttled=True)
+            app_logger.warning(f"Сервер ограничил скорость, письмо {email.id} отложено на {delay:.1f} с: {str(e)}")
+            return
+        app_logger.warning(
+            f"Попытка {attempts}/{settings.email_max_retries + 1} отправки {email.id} не удалась: {str(e)}"
+        )
+        if attempts <= settings.email_max_retries:
+            await schedule_retry(session_manager, email.id, attempts, str(e))
             return
+        await set_email_status(session_manager, email.id, StatusType.ERROR, str(e), writer)
+        app_logger.error(
+            f"Письмо {email.id} не отправлено после {settings.email_max_retries} повторов"
+        )
+        return
+    except Exception as e:
+        await set_email_status(session_manager, email.id, StatusType.ERROR, str(e), writer)
+        app_logger.error(f"Неустранимая ошибка при отправке {email.id}: {str(e)}")
+        return
 
-        except smtplib.SMTPException as e:
-            app_logger.warning(
-                f"Попытка {attempt + 1}/{max_retries} отправки {email_id} не удалась: {str(e)}"
-            )
-            record = await session.get(EmailData, email_id, with_for_update=True)
+    await set_email_status(session_manager, email.id, StatusType.PROCESSED, writer=writer)
+    app_logger.info("Письмо %s успешно отправлено", email.id)
 
-            if attempt < max_retries:
-                record.status = StatusType.RETRY
-                record.error = str(e)
-                await asyncio.sleep(retry_delay * (2 ** attempt))
-            else:
-                record.status = StatusType.ERROR
-                record.error = str(e)
-                app_logger.error(
-                    f"Письмо {email_id} не отправлено после {max_retries} попыток"
-                )
-                return
 
+async def _admit(session_manager: SessionManager, emails: list[OutgoingEmail]) -> list[OutgoingEmail]:
+    """Пропускает письма через ограничение скорости, не пропущенные откладывает."""
+    admitted = []
+    for email in emails:
+        delay = await rate_limiter.acquire(email.address)
+        if delay is None:
+            admitted.append(email)
+        else:
+            await defer_email(session_manager, email.id, delay, "Отложено ограничением скорости")
+    return admitted
+
+
+def domain_chunks(emails: list[OutgoingEmail], step: int) -> list[list[OutgoingEmail]]:
+    """Делит письма на транзакции по step получателей одного домена: ответ 421/451 и откладывание
+    относятся к домену, другие домены из-за него не задерживаются."""
+    by_domain: dict[str, list[OutgoingEmail]] = {}
+    for email in emails:
+        by_domain.setdefault(recipient_domain(email.address), []).append(email)
+    return [group[start:start + step] for group in by_domain.values() for start in range(0, len(group), step)]
+
+
+async def deliver_bulk(session_manager: SessionManager, emails: list[OutgoingEmail]):
+    """Отправляет письма с одинаковым содержимым, по smtp_max_recipients получателей одного домена
+    на транзакцию SMTP.
+
+    Отклоненные получатели и получатели неудачной транзакции уходят в повтор по одному через RetryScheduler.
+    """
+    async with lease_heartbeat(session_manager, [email.id for email in emails]):
+        await _deliver_bulk(session_manager, emails)
+
+
+async def _deliver_bulk(session_manager: SessionManager, emails: list[OutgoingEmail]):
+    first = emails[0]
+    for domain_chunk in domain_chunks(emails, settings.smtp_max_recipients):
+        chunk = await _admit(session_manager, domain_chunk)
+        if not chunk:
+            continue
+        ids = [email.id for email in chunk]
+        try:
+            refused = await send_email(
+                to=[email.address for email in chunk],
+                subject=first.subject,
+                message=first.message,
+                body=first.body,
+                attachments=first.attachments,
+            )
+        except smtplib.SMTPException as e:
+            app_logger.warning(f"Отправка рассылки на {len(chunk)} адресов не удалась: {str(e)}")
+            deferrals = max(email.deferrals for email in chunk)
+            if is_throttling(e) and deferrals < settings.email_max_deferrals:
+                delay = throttled_delay(chunk[0].address, deferrals + 1)
+                await defer_email(session_manager, ids, delay, str(e), throttled=True)
+            else:
+                await schedule_retry(session_manager, ids, 1, str(e))
+            continue
         except Exception as e:
-            record = await session.get(EmailData, email_id, with_for_update=True)
-            record.status = StatusType.ERROR
-            record.error = str(e)
-            app_logger.error(f"Неустранимая ошибка при отправке {email_id}: {str(e)}")
-            return
+            await set_email_status(session_manager, ids, StatusType.ERROR, str(e))
+            app_logger.error(f"Неустранимая ошибка при отправке рассылки на {len(chunk)} адресов: {str(e)}")
+            continue
+
+        refused_ids = [email.id for email in chunk if email.address in refused]
+        if refused_ids:
+            app_logger.warning(f"Сервер отклонил получателей рассылки: {', '.join(refused)}")
+            await schedule_retry(session_manager, refused_ids, 1, str(refused))
+        accepted_ids = [email_id for email_id in ids if email_id not in refused_ids]
+        if accepted_ids:
+            await set_email_status(session_manager, accepted_ids, StatusType.PROCESSED)
+        app_logger.info("Рассылка отправлена: %s из %s адресов", len(accepted_ids), len(chunk))
+
+
+async def send_new_email(session_manager: SessionManager, email_id: int):
+    # Каждая смена статуса - отдельная короткая транзакция: во время отправки
+    # соединение с Postgres и блокировка строки не удерживаются.
+    email = await claim_email(session_manager, email_id)
+    if not email:
+        app_logger.info("Пропуск email %s: запись не найдена или уже обрабатывается", email_id)
+        return
+    await deliver_email(session_manager, email)
@@ -0,0 +1,44 @@
+import hashlib
+from collections import OrderedDict
+
+from src.database.rabbit import MessageInfo
+from src.settings.app import settings
+
+
+def idempotency_key(message_info: MessageInfo) -> str | None:
+    """Ключ из сообщения, если его нет - message_id из свойств AMQP."""
+    return message_info.message.idempotency_key or message_info.message_meta.message_id
+
+
+def recipient_key(key: str, to: str) -> str:
+    """Ключ получателя рассылки: хеш, чтобы длинный ключ с адресом помещался в String(255)."""
+    return hashlib.sha256(f"{key}:{to}".encode()).hexdigest()
+
+
+class RecentKeys:
+    """Недавно обработанные ключи идемпотентности в памяти процесса.
+
+    Повторную доставку после сбоя брокера можно подтвердить без запроса в Postgres.
+    Ключ, вытесненный из LRU, все равно отсекается уникальным индексом в email_data.
+    """
+
+    def __init__(self, max_size: int = settings.idempotency_cache_size) -> None:
+        self.max_size = max_size
+        self._keys: OrderedDict[str, None] = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        if key not in self._keys:
+            return False
+        self._keys.move_to_end(key)
+        return True
+
+    def add(self, key: str) -> None:
+        if self.max_size <= 0:
+            return
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+
+recent_keys = RecentKeys()
@@ -0,0 +1,149 @@
+import base64
+import mimetypes
+import uuid
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+from email.utils import getaddresses
+from functools import lru_cache, partial
+
+from src.service.attachment_store import attachment_chunks
+from src.service.mime_writer import CRLF, PreparedMessage, StreamingMessage
+from src.settings.app import settings
+
+# Длина строки, до которой заголовок из ASCII пишется как есть, без сворачивания политикой email
+MAX_HEADER_LINE = 78
+# Предел длины строки для 7bit по RFC 5322, более длинные строки кодируются в base64
+MAX_BODY_LINE = 998
+
+_TEXT_HEADERS = {
+    (subtype, cte): f'Content-Type: text/{subtype}; charset="utf-8"\r\nContent-Transfer-Encoding: {cte}\r\n'.encode()
+    for subtype in ("plain", "html")
+    for cte in ("7bit", "base64")
+}
+
+
+def envelope_recipients(to: str | list[str]) -> list[str]:
+    return [to] if isinstance(to, str) else to
+
+
+def to_header(to: str | list[str]) -> str:
+    recipients = envelope_recipients(to)
+    # Письмо нескольким получателям уходит одной транзакцией SMTP, адреса не раскрываются в заголовке
+    return recipients[0] if len(recipients) == 1 else "undisclosed-recipients:;"
+
+
+@lru_cache(maxsize=1024)
+def guess_mime_type(filename: str) -> tuple[str, str]:
+    mime_type, _ = mimetypes.guess_type(filename)
+    main_type, sub_type = (mime_type or "application/octet-stream").split("/", 1)
+    return main_type, sub_type
+
+
+@lru_cache(maxsize=1024)
+def _fold_header(name: str, value: str) -> bytes:
+    # Темы писем одной рассылки совпадают, поэтому свернутые заголовки кешируются
+    return SMTP.fold_binary(name, SMTP.header_store_parse(name, value)[1])
+
+
+def header_line(name: str, value: str) -> bytes:
+    """Заголовок в байтах для SMTP. Короткое значение из ASCII пишется напрямую, остальное
+    (не ASCII, длинные строки) сворачивает и кодирует политика email."""
+    if (
+        len(name) + len(value) + 2 <= MAX_HEADER_LINE
+        and value.isascii()
+        and value.isprintable()
+        and "=?" not in value
+    ):
+        return f"{name}: {value}\r\n".encode()
+    return _fold_header(name, value)
+
+
+@lru_cache(maxsize=16)
+def sender_block(sender: str) -> tuple[str, bytes]:
+    """Адрес для MAIL FROM и неизменный для отправителя блок заголовков: считаются один раз."""
+    return getaddresses([sender])[0][1], header_line("From", sender)
+
+
+def _text_part(subtype: str, text: str) -> bytes:
+    """Текстовая часть с заголовками: 7bit для ASCII с короткими строками, иначе base64 в UTF-8."""
+    # Строки делятся как в email.contentmanager: только по CR, LF и CRLF
+    lines = text.encode().splitlines()
+    if text.isascii() and max(map(len, lines), default=0) <= MAX_BODY_LINE:
+        return _TEXT_HEADERS[subtype, "7bit"] + CRLF + CRLF.join(lines) + CRLF
+    # Текст в base64 кодируется в каноническом виде MIME, с CRLF: так же его получал получатель из 8bit
+    data = CRLF.join(lines) + CRLF
+    return _TEXT_HEADERS[subtype, "base64"] + CRLF + base64.encodebytes(data).replace(b"\n", CRLF)
+
+
+def prepare_message(
+        to: str | list[str],
+        subject: str,
+        message: str | None,
+        body: str | None,
+) -> PreparedMessage:
+    """Быстрая сборка письма без вложений: байты пишутся напрямую, без дерева объектов email."""
+    from_addr, head = sender_block(settings.email_from)
+    head += header_line("To", to_header(to)) + header_line("Subject", subject)
+    if not message and not body:
+        return PreparedMessage(from_addr, head + CRLF)
+    head += b"MIME-Version: 1.0\r\n"
+    if not message or not body:
+        return PreparedMessage(from_addr, head + _text_part("plain" if message else "html", message or body))
+
+    delimiter = f"--==============={uuid.uuid4().hex}==".encode()
+    data = b"".join((
+        head,
+        b'Content-Type: multipart/alternative; boundary="', delimiter[2:], b'"\r\n\r\n',
+        delimiter, CRLF, _text_part("plain", message),
+        CRLF, delimiter, CRLF, _text_part("html", body),
+        CRLF, delimiter, b"--\r\n",
+    ))
+    return PreparedMessage(from_addr, data)
+
+
+def _set_body(msg: EmailMessage | MIMEPart, message: str | None, body: str | None) -> None:
+    if message:
+        msg.set_content(message)
+    if body:
+        msg.add_alternative(body, subtype="html")
+
+
+def build_message(
+        to: str | list[str],
+        subject: str,
+        message: str | None,
+        body: str | None,
+        attachments: list | None,
+) -> EmailMessage | StreamingMessage:
+    """Собирает письмо через email. Письмо с вложениями собирается потоково: вложения читаются
+    и кодируются кусками во время отправки, а не целиком в памяти."""
+    msg = EmailMessage()
+    msg["From"] = settings.email_from
+    msg["To"] = to_header(to)
+    msg["Subject"] = subject
+    if not attachments:
+        _set_body(msg, message, body)
+        return msg
+
+    body_part = None
+    if message or body:
+        body_part = MIMEPart(policy=SMTP)
+        _set_body(body_part, message, body)
+    streaming = StreamingMessage(msg, body_part)
+    for attachment in attachments:
+        main_type, sub_type = guess_mime_type(attachment["filename"])
+        streaming.add_attachment(partial(attachment_chunks, attachment), main_type, sub_type, attachment["filename"])
+    return streaming
+
+
+def assemble_message(
+        to: str | list[str],
+        subject: str,
+        message: str | None,
+        body: str | None,
+        attachments: list | None,
+) -> PreparedMessage | StreamingMessage | EmailMessage:
+    """Письмо без вложений собирается быстрым путем, с вложениями - потоково через build_message."""
+    if attachments:
+        return build_message(to, subject, message, body, attachments)
+    return prepare_message(to, subject, message, body)
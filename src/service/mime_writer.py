@@ -0,0 +1,97 @@
+import base64
+import re
+import uuid
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+CRLF = b"\r\n"
+_LEADING_DOT = re.compile(rb"(?m)^\.")
+_LINE_ENDINGS = re.compile(rb"\r\n|\r|\n")
+
+
+def quote_data(data: bytes) -> bytes:
+    data = _LINE_ENDINGS.sub(CRLF, data)
+    data = _LEADING_DOT.sub(b"..", data)
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data
+
+
+# Сырые байты на один кусок base64: кратно 57, чтобы строки по 76 символов не рвались между кусками
+ATTACHMENT_CHUNK_SIZE = 57 * 4096
+
+AttachmentSource = Callable[[int], Iterable[bytes | memoryview]]
+
+
+class AttachmentReadError(Exception):
+    """Вложение не прочиталось во время отправки: это не ошибка SMTP, повтор не поможет."""
+
+
+def _fold_headers(part: EmailMessage | MIMEPart) -> bytes:
+    return b"".join(SMTP.fold_binary(name, value) for name, value in part.items())
+
+
+def encode_base64(chunks: Iterable[bytes | memoryview]) -> Iterator[bytes]:
+    """Кодирует поток байтов в base64 строками по 76 символов с CRLF, не собирая его целиком."""
+    tail = b""
+    for chunk in chunks:
+        if tail:
+            chunk = tail + bytes(chunk)
+        cut = len(chunk) - len(chunk) % 57
+        if cut:
+            yield base64.encodebytes(chunk[:cut]).replace(b"\n", CRLF)
+        tail = bytes(chunk[cut:])
+    if tail:
+        yield base64.encodebytes(tail).replace(b"\n", CRLF)
+
+
+class PreparedMessage(NamedTuple):
+    """Письмо, уже собранное в байты для SMTP (CRLF, без удвоения точек), с адресом отправителя."""
+
+    from_addr: str
+    data: bytes
+
+
+class StreamingMessage:
+    """Письмо multipart/mixed, которое отдается кусками для команды DATA.
+
+    Заголовки и текстовые части небольшие и собираются через email, вложения читаются
+    из источника кусками и кодируются в base64 по мере отправки. В памяти одновременно
+    находится не больше одного куска вложения, сколько бы весили вложения целиком.
+    """
+
+    def __init__(self, headers: EmailMessage, body: MIMEPart | None) -> None:
+        self.headers = headers
+        self.body = body
+        self.attachments: list[tuple[MIMEPart, AttachmentSource]] = []
+        self.boundary = f"==============={uuid.uuid4().hex}=="
+        headers["MIME-Version"] = "1.0"
+        headers["Content-Type"] = f'multipart/mixed; boundary="{self.boundary}"'
+
+    def add_attachment(self, source: AttachmentSource, maintype: str, subtype: str, filename: str) -> None:
+        """source(size) отдает содержимое вложения кусками примерно по size байт."""
+        part = MIMEPart(policy=SMTP)
+        part["Content-Type"] = f"{maintype}/{subtype}"
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=filename)
+        self.attachments.append((part, source))
+
+    def chunks(self) -> Iterator[bytes]:
+        """Куски письма, готовые к записи после DATA: строки с CRLF, точки в начале строк удвоены.
+
+        Каждый кусок заканчивается CRLF.
+        """
+        delimiter = b"--" + self.boundary.encode()
+        head = _fold_headers(self.headers) + CRLF
+        if self.body is not None:
+            head += CRLF + delimiter + CRLF + self.body.as_bytes(policy=SMTP)
+        yield quote_data(head)
+        for part, source in self.attachments:
+            yield CRLF + delimiter + CRLF + quote_data(_fold_headers(part)) + CRLF
+            # В base64 нет точек и одиночных CR/LF, куски уходят без экранирования
+            try:
+                yield from encode_base64(source(ATTACHMENT_CHUNK_SIZE))
+            except OSError as e:
+                raise AttachmentReadError(f"Не удалось прочитать вложение: {e}") from e
+        yield CRLF + delimiter + b"--" + CRLF
@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from src.settings.app import Settings, settings
+
+
+def recipient_domain(address: str) -> str:
+    return address.rpartition("@")[2].lower()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """Занимает токен, при необходимости в долг, и возвращает, сколько секунд ждать до его появления."""
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def try_acquire(self) -> float:
+        """Берет токен и возвращает 0 или, если токена нет, сколько секунд ждать следующего."""
+        wait = self.reserve()
+        if wait:
+            self.refund()
+        return wait
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def drain(self) -> None:
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class SendRateLimiter:
+    """Ограничение скорости отправки token bucket'ами на SMTP аккаунт и на домен получателя.
+
+    Короткое ожидание домена (до max_wait) пережидается в обработчике, при более долгом письмо
+    нужно отложить: acquire возвращает задержку, отложенные письма одного домена распределяются
+    по времени с его скоростью. Токены аккаунта раздаются по кругу между доменами,
+    поэтому всплеск писем на один домен не задерживает остальные.
+    """
+
+    def __init__(
+        self,
+        account_rate: float,
+        account_burst: int,
+        domain_rate: float,
+        domain_burst: int,
+        domain_rates: dict[str, float],
+        max_wait: float,
+    ) -> None:
+        self.account = TokenBucket(account_rate, account_burst) if account_rate > 0 else None
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.domain_rates = {domain.lower(): rate for domain, rate in domain_rates.items()}
+        self.max_wait = max_wait
+        self._domains: dict[str, TokenBucket | None] = {}
+        self._deferred_until: dict[str, float] = {}
+        self._waiters: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self._dispatcher: asyncio.Task | None = None
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "SendRateLimiter":
+        return cls(
+            account_rate=settings.smtp_rate_limit,
+            account_burst=settings.smtp_rate_burst,
+            domain_rate=settings.domain_rate_limit,
+            domain_burst=settings.domain_rate_burst,
+            domain_rates=settings.domain_rate_limits,
+            max_wait=settings.rate_limit_max_wait,
+        )
+
+    def _domain_bucket(self, domain: str) -> TokenBucket | None:
+        if domain not in self._domains:
+            rate = self.domain_rates.get(domain, self.domain_rate)
+            self._domains[domain] = TokenBucket(rate, self.domain_burst) if rate > 0 else None
+        return self._domains[domain]
+
+    def _defer_delay(self, domain: str, bucket: TokenBucket, wait: float) -> float:
+        now = time.monotonic()
+        slot = max(now + wait, self._deferred_until.get(domain, 0.0))
+        self._deferred_until[domain] = slot + 1 / bucket.rate
+        return slot - now
+
+    async def acquire(self, address: str) -> float | None:
+        """Ждет разрешения на отправку письма на address.
+
+        Возвращает None, если можно отправлять, или задержку в секундах, на которую письмо нужно отложить.
+        """
+        domain = recipient_domain(address)
+        bucket = self._domain_bucket(domain)
+        if bucket is not None:
+            wait = bucket.reserve()
+            if wait > self.max_wait:
+                bucket.refund()
+                return self._defer_delay(domain, bucket, wait)
+            if wait:
+                await asyncio.sleep(wait)
+        if self.account is not None:
+            await self._acquire_account(domain)
+        return None
+
+    def throttled(self, address: str) -> float:
+        """Сервер ответил 421/451: токены домена обнуляются, возвращается задержка для письма."""
+        domain = recipient_domain(address)
+        bucket = self._domain_bucket(domain)
+        if bucket is None:
+            return float(settings.email_retry_delay)
+        bucket.drain()
+        return self._defer_delay(domain, bucket, max(settings.email_retry_delay, 1 / bucket.rate))
+
+    async def _acquire_account(self, domain: str) -> None:
+        if not self._waiters and self.account.try_acquire() == 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(domain, deque()).append(future)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            wait = self.account.try_acquire()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            # Домен, получивший токен, уходит в конец очереди
+            domain, waiters = self._waiters.popitem(last=False)
+            future = waiters.popleft()
+            if waiters:
+                self._waiters[domain] = waiters
+            if future.done():
+                self.account.refund()
+            else:
+                future.set_result(None)
+
+
+rate_limiter = SendRateLimiter.from_settings(settings)
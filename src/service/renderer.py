@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+import orjson
+from jinja2 import BaseLoader, ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader, ModuleLoader
+
+from src.app_logger import app_logger
+from src.settings.app import Settings, settings
+
+template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def date_filter(value, format_string):
+    if isinstance(value, datetime):
+        return value.strftime(format_string)
+    return value
+
+
+def create_environment() -> Environment:
+    loader: BaseLoader = FileSystemLoader(template_dir)
+    if settings.templates_precompiled_dir and os.path.isdir(settings.templates_precompiled_dir):
+        # Скомпилированные модули в приоритете, исходники нужны для шаблонов, добавленных после сборки
+        loader = ChoiceLoader([ModuleLoader(settings.templates_precompiled_dir), loader])
+
+    bytecode_cache = None
+    if settings.templates_bytecode_cache_dir:
+        os.makedirs(settings.templates_bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(settings.templates_bytecode_cache_dir)
+
+    environment = Environment(
+        loader=loader,
+        autoescape=True,
+        auto_reload=settings.templates_auto_reload,
+        bytecode_cache=bytecode_cache,
+        # Без ограничения: прогретые шаблоны не вытесняются из памяти
+        cache_size=-1,
+    )
+    environment.filters['date'] = date_filter
+    return environment
+
+
+def create_source_environment() -> Environment:
+    """Окружение только с исходниками: ChoiceLoader с ModuleLoader не умеет перечислять шаблоны."""
+    environment = Environment(loader=FileSystemLoader(template_dir), autoescape=True)
+    environment.filters['date'] = date_filter
+    return environment
+
+
+env = create_environment()
+
+
+def list_templates() -> list[str]:
+    return FileSystemLoader(template_dir).list_templates()
+
+
+def warm_up_templates() -> None:
+    """Компилирует все шаблоны заранее, чтобы первое письмо не платило за компиляцию."""
+    start = time.perf_counter()
+    names = list_templates()
+    for name in names:
+        env.get_template(name)
+    app_logger.info("Шаблоны загружены: %s за %.1f мс", len(names), (time.perf_counter() - start) * 1000)
+
+
+def compile_templates(target: str) -> None:
+    create_source_environment().compile_templates(target, zip=None)
+    app_logger.info("Шаблоны скомпилированы в %s", target)
+
+
+def get_base_context():
+    image_url = "%semails/{name}" % (settings.s3_url,)
+    return {
+        "anonymous_img": image_url.format(name="anon.png"),
+        "media_url": f"{settings.s3_url}media/",
+    }
+
+
+def render_template(name: str, context: dict) -> str:
+    return env.get_template(name).render(context)
+
+
+class RenderEngine:
+    """Рендерит шаблоны в event loop или в пуле процессов.
+
+    inline - рендер в текущем потоке, process - всегда в пуле процессов, auto - в пуле только
+    тяжелые шаблоны: с большим исходником или большим контекстом. Каждый процесс пула при старте
+    загружает все шаблоны в свое окружение Jinja.
+    """
+
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self._executor: ProcessPoolExecutor | None = None
+        self._template_sizes: dict[str, int] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.settings.render_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_templates,
+            )
+        return self._executor
+
+    def _template_size(self, name: str) -> int:
+        if name not in self._template_sizes:
+            try:
+                self._template_sizes[name] = os.path.getsize(os.path.join(template_dir, name))
+            except OSError:
+                self._template_sizes[name] = 0
+        return self._template_sizes[name]
+
+    def is_heavy(self, name: str, context: dict) -> bool:
+        if self._template_size(name) >= self.settings.render_process_min_template_bytes:
+            return True
+        return len(orjson.dumps(context, default=str)) >= self.settings.render_process_min_context_bytes
+
+    def select_mode(self, name: str, context: dict) -> str:
+        if self.settings.render_mode == "auto":
+            return "process" if self.is_heavy(name, context) else "inline"
+        return self.settings.render_mode
+
+    async def render(self, name: str, context: dict) -> str:
+        mode = self.select_mode(name, context)
+        start = time.perf_counter()
+        if mode == "process":
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(self._get_executor(), render_template, name, context)
+        else:
+            body = render_template(name, context)
+        settings.prometheus.metrics.render_duration.labels(mode=mode).observe(time.perf_counter() - start)
+        return body
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+class RenderedBody(NamedTuple):
+    body: str
+    hash: str
+
+    @classmethod
+    def from_body(cls, body: str) -> "RenderedBody":
+        return cls(body=body, hash=hashlib.sha256(body.encode()).hexdigest())
+
+
+class RenderCache:
+    """LRU кеш отрендеренных писем с TTL и ограничением по памяти.
+
+    Ключ - имя шаблона и хеш контекста, сериализованного orjson с сортировкой ключей,
+    поэтому одинаковые контексты с разным порядком полей попадают в одну запись.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, RenderedBody, int]] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(template: str, context: dict | None) -> str:
+        payload = orjson.dumps(context, option=orjson.OPT_SORT_KEYS, default=str)
+        return hashlib.sha256(template.encode() + b"\0" + payload).hexdigest()
+
+    def get(self, key: str) -> RenderedBody | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._evict(key)
+            self.misses += 1
+            settings.prometheus.metrics.render_cache_misses.inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        settings.prometheus.metrics.render_cache_hits.inc()
+        return entry[1]
+
+    def put(self, key: str, rendered: RenderedBody) -> None:
+        size = sys.getsizeof(rendered.body)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (time.monotonic() + self.ttl, rendered, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+
+render_engine = RenderEngine(settings)
+render_cache = RenderCache(max_bytes=settings.render_cache_max_bytes, ttl=settings.render_cache_ttl)
+
+
+async def render_body(template: str | None, context: dict | None) -> RenderedBody | None:
+    if not template:
+        return None
+    key = None
+    if render_cache.enabled:
+        key = render_cache.make_key(template, context)
+        cached = render_cache.get(key)
+        if cached is not None:
+            return cached
+
+    full_ctx = get_base_context()
+    if context:
+        full_ctx.update(context)
+    rendered = RenderedBody.from_body(await render_engine.render(template, full_ctx))
+    if key is not None:
+        render_cache.put(key, rendered)
+    return rendered
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Использование: python -m src.service.renderer <каталог для скомпилированных шаблонов>")
+    compile_templates(sys.argv[1])
@@ -0,0 +1,88 @@
+import asyncio
+from contextlib import suppress
+
+from sqlalchemy import Row, func, or_, select, update
+
+from src.app_logger import app_logger
+from src.database.batch_writer import EmailDataBatchWriter
+from src.database.models.email_data import EmailData, StatusType
+from src.database.postgres import SessionManager
+from src.service.email_sender import EMAIL_SEND_COLUMNS, deliver_email
+from src.settings.app import settings
+
+
+class RetryScheduler:
+    """Фоновая задача, повторяющая отправку писем в статусе RETRY, у которых наступил next_attempt_at.
+
+    Писем берется в работу не больше, чем свободно мест для отправки: взятое письмо отправляется
+    сразу, а не ждет своей очереди в PROCESSING, пока истекает его аренда.
+    """
+
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        concurrency: int = settings.workers,
+        batch_size: int = settings.retry_batch_size,
+        poll_interval: int = settings.retry_poll_interval,
+        writer: EmailDataBatchWriter | None = None,
+    ):
+        self.session_manager = session_manager
+        self.writer = writer
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._sending: set[asyncio.Task] = set()
+
+    async def claim_due(self, limit: int) -> list[Row]:
+        due = (
+            select(EmailData.id)
+            .where(
+                EmailData.status == StatusType.RETRY,
+                or_(EmailData.next_attempt_at.is_(None), EmailData.next_attempt_at <= func.now()),
+            )
+            .order_by(EmailData.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        async with self.session_manager() as session:
+            result = await session.execute(
+                update(EmailData)
+                .where(EmailData.id.in_(due.scalar_subquery()))
+                .values(status=StatusType.PROCESSING, error=None)
+                .returning(*EMAIL_SEND_COLUMNS)
+            )
+            return result.all()
+
+    async def _deliver(self, email: Row) -> None:
+        try:
+            await deliver_email(self.session_manager, email, self.writer)
+        except Exception as e:
+            app_logger.error(f"Ошибка при повторной отправке письма {email.id}: {e}")
+
+    async def run_once(self, group: asyncio.TaskGroup) -> tuple[int, int]:
+        """Берет в работу письма на свободные места и возвращает, сколько взято и сколько запрашивалось."""
+        limit = min(self.batch_size, self.concurrency - len(self._sending))
+        emails = await self.claim_due(limit)
+        if emails:
+            app_logger.info("Повторная отправка писем: %s", len(emails))
+        for email in emails:
+            task = group.create_task(self._deliver(email))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+        return len(emails), limit
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        # Выход из группы дожидается писем, уже взятых в работу
+        async with asyncio.TaskGroup() as group:
+            while not stopping.is_set():
+                if len(self._sending) >= self.concurrency:
+                    await asyncio.wait([*self._sending], return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                try:
+                    claimed, limit = await self.run_once(group)
+                except Exception as e:
+                    app_logger.error(f"Ошибка при повторной отправке писем: {e}")
+                    claimed, limit = 0, 1
+                if claimed < limit:
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(stopping.wait(), timeout=self.poll_interval)
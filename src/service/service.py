@@ -1,79 +1,271 @@
-import os
-from asyncio import sleep
-from datetime import datetime
+import asyncio
+import time
+from contextlib import suppress
 
-from jinja2 import Environment, FileSystemLoader
-from sqlalchemy.ext.asyncio import AsyncSession
-
-from src.app_logger import app_logger
-from src.database.models.email_data import EmailData, StatusType
+from src.app_logger import app_logger, log_context
+from src.database.batch_writer import EmailDataBatchWriter, insert_emails
+from src.database.email_body_store import email_body_store
+from src.database.models.email_data import StatusType
 from src.database.postgres import SessionManager
-from src.database.rabbit import MessageInfo, RabbitMessageProcessor
-from src.service.email_sender import send_email_with_retries
+from src.database.rabbit import (
+    BulkEmailMessage,
+    EmailMessage,
+    MessageInfo,
+    RabbitMessageProcessor,
+    RabbitReadError,
+)
+from src.service.attachment_store import store_attachments
+from src.service.email_sender import OutgoingEmail, deliver_bulk, deliver_email, send_new_email
+from src.service.idempotency import idempotency_key, recent_keys, recipient_key
+from src.service.renderer import RenderCache, RenderedBody, render_body
+from src.service.retry_scheduler import RetryScheduler
+from src.service.sweeper import StaleEmailSweeper
 from src.settings.app import settings
 
-template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
-env = Environment(loader=FileSystemLoader(template_dir), autoescape=True)
 
-def date_filter(value, format_string):
-    if isinstance(value, datetime):
-        return value.strftime(format_string)
-    return value
+class Service:
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        rabbit_processor: RabbitMessageProcessor,
+        workers: int = settings.workers,
+    ):
+        self.session_manager = session_manager
+        self.rabbit = rabbit_processor
+        self.workers = workers
+        self.writer = None
+        if settings.db_batching:
+            self.writer = EmailDataBatchWriter(
+                session_manager,
+                batch_size=settings.db_batch_size,
+                max_latency=settings.db_batch_max_latency_ms / 1000,
+            )
+        self.retry_scheduler = RetryScheduler(session_manager, concurrency=workers, writer=self.writer)
+        self.sweeper = StaleEmailSweeper(session_manager)
+        self._stopping = asyncio.Event()
+        self._started_at: float | None = None
+        self._first_message_logged = False
 
-env.filters['date'] = date_filter
+    @property
+    def concurrency(self) -> int:
+        # Каждый обработчик держит не больше одного неподтвержденного сообщения,
+        # поэтому больше prefetch_count обработчиков брокер все равно не загрузит.
+        return min(self.workers, self.rabbit.reader.settings.prefetch_count)
 
+    @staticmethod
+    def _shared_body(rendered: RenderedBody | None) -> tuple[str, str] | None:
+        if rendered and settings.body_storage == "shared":
+            return rendered.hash, rendered.body
+        return None
 
-def get_base_context():
-    image_url = "%semails/{name}" % (settings.s3_url,)
-    return {
-        "anonymous_img": image_url.format(name="anon.png"),
-        "media_url": f"{settings.s3_url}media/",
-    }
+    def _email_row(
+            self,
+            to: str,
+            email_data: EmailMessage | BulkEmailMessage,
+            context: dict | None,
+            rendered: RenderedBody | None,
+            attachments: list | None,
+            key: str | None,
+    ) -> dict:
+        shared = self._shared_body(rendered) is not None
+        return {
+            "address": to,
+            "subject": email_data.subject,
+            "template": email_data.template,
+            "context": context,
+            "body": rendered.body if rendered and not shared else None,
+            "body_hash": rendered.hash if shared else None,
+            "attachments": attachments,
+            "idempotency_key": key,
+        }
 
+    async def process_bulk_message(self, bulk: BulkEmailMessage, key: str | None = None):
+        """Разворачивает рассылку в строки EmailData одной вставкой и отправляет получателей с одинаковым
+        контекстом одним письмом на несколько RCPT TO."""
+        groups: dict[str, tuple[dict | None, list[str]]] = {}
+        for recipient in bulk.recipients:
+            context = {**(bulk.context or {}), **recipient.context} if recipient.context else bulk.context
+            group = RenderCache.make_key(bulk.template or "", context)
+            groups.setdefault(group, (context, []))[1].append(recipient.to)
 
-async def generate_body(template: str | None, context: dict | None) -> str | None:
-    if not template:
-        return None
-    full_ctx = get_base_context()
-    if context:
-        full_ctx.update(context)
-    template = env.get_template(template)
-    return template.render(full_ctx)
+        rendered = {group: await render_body(bulk.template, context) for group, (context, _) in groups.items()}
+        attachments = await store_attachments(bulk.attachments)
+        rows = [
+            {
+                **self._email_row(to, bulk, context, rendered[group], attachments, key and recipient_key(key, to)),
+                "status": StatusType.PROCESSING,
+            }
+            for group, (context, addresses) in groups.items()
+            for to in addresses
+        ]
+        bodies = dict(body for body in map(self._shared_body, rendered.values()) if body)
 
+        async with self.session_manager() as session:
+            stored = await email_body_store.save(session, bodies) if bodies else []
+            ids = iter(await insert_emails(session, rows))
+        email_body_store.remember(stored)
+        if key:
+            recent_keys.add(key)
+        app_logger.info("Рассылка на %s адресов, различных писем: %s", len(rows), len(groups))
 
-class Service:
-    def __init__(
-        self, session_manager: SessionManager, rabbit_processor: RabbitMessageProcessor
-    ):
-        self.session_manager = session_manager
-        self.rabbit = rabbit_processor
+        for group, (_, addresses) in groups.items():
+            body = rendered[group].body if rendered[group] else None
+            emails = [
+                OutgoingEmail(
+                    id=email_id,
+                    address=to,
+                    subject=bulk.subject,
+                    message=bulk.message,
+                    body=body,
+                    attachments=attachments,
+                )
+                for to, email_id in zip(addresses, ids, strict=False)
+                if email_id is not None
+            ]
+            if len(emails) < len(addresses):
+                app_logger.info("Пропущено уже записанных адресов рассылки: %s", len(addresses) - len(emails))
+            if emails:
+                await deliver_bulk(self.session_manager, emails)
 
     @staticmethod
-    async def process_message(session: AsyncSession, message_info: MessageInfo):
+    def _is_new(email_id: int | None, key: str | None) -> bool:
+        if key:
+            recent_keys.add(key)
+        if email_id is None:
+            app_logger.info("Письмо с ключом %s уже записано, повторная отправка пропущена", key)
+            return False
+        return True
+
+    async def process_message(self, message_info: MessageInfo):
         email_data = message_info.message
-        body = await generate_body(email_data.template, email_data.context)
-        record = EmailData(
-            address=email_data.to,
-            subject=email_data.subject,
-            template=email_data.template,
-            context=email_data.context,
-            body=body,
-            attachments=email_data.attachments,
-            status=StatusType.NEW,
-        )
-        session.add(record)
-        await session.flush()
-        await send_email_with_retries(session=session, email_id=record.id)
+        key = idempotency_key(message_info)
+        if key and key in recent_keys:
+            app_logger.info("Повторное сообщение с ключом %s пропущено", key)
+            return
+        if isinstance(email_data, BulkEmailMessage):
+            await self.process_bulk_message(email_data, key)
+            return
+
+        rendered = await render_body(email_data.template, email_data.context)
+        body = rendered.body if rendered else None
+        shared_body = self._shared_body(rendered)
+        attachments = await store_attachments(email_data.attachments)
+        row = self._email_row(email_data.to, email_data, email_data.context, rendered, attachments, key)
+
+        if self.writer:
+            # Строка сразу создается в PROCESSING: отдельная транзакция на захват письма не нужна
+            email_id = await self.writer.insert({**row, "status": StatusType.PROCESSING}, shared_body)
+            if not self._is_new(email_id, key):
+                return
+            email = OutgoingEmail(
+                id=email_id,
+                address=email_data.to,
+                subject=email_data.subject,
+                message=email_data.message,
+                body=body,
+                attachments=attachments,
+            )
+            await deliver_email(self.session_manager, email, self.writer)
+            return
+
+        stored = []
+        async with self.session_manager() as session:
+            if shared_body:
+                stored = await email_body_store.save(session, dict([shared_body]))
+            [email_id] = await insert_emails(session, [{**row, "status": StatusType.NEW}])
+        email_body_store.remember(stored)
+        if not self._is_new(email_id, key):
+            return
+        await send_new_email(session_manager=self.session_manager, email_id=email_id)
+
+    async def _idle(self, delay: float) -> None:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+
+    async def _handle_next(self) -> None:
+        async with self.rabbit() as message:
+            if not message or not message.message:
+                # В режиме consume чтение само ждет сообщение, пауза нужна только при опросе
+                if not self.rabbit.streaming:
+                    await self._idle(1)
+                return
+            metrics = settings.prometheus.metrics
+            with (
+                log_context(delivery_tag=message.message_meta.delivery_tag),
+                metrics.messages_in_flight.track_inprogress(),
+                metrics.handle_message_duration.time(),
+            ):
+                await self.process_message(message)
+            if not self._first_message_logged:
+                self._first_message_logged = True
+                app_logger.info(
+                    "Первое сообщение обработано через %.1f мс после запуска",
+                    (time.perf_counter() - self._started_at) * 1000,
+                )
+
+    async def _worker(self, worker_id: int) -> None:
+        app_logger.debug("Обработчик %s запущен", worker_id)
+        while not self._stopping.is_set():
+            try:
+                await self._handle_next()
+            except RabbitReadError:
+                raise
+            except Exception as e:
+                # Сообщение уже отклонено (nack) и уйдет в dead-letter очередь
+                app_logger.error(f"Ошибка обработки сообщения: {str(e)}")
+        app_logger.debug("Обработчик %s остановлен", worker_id)
+
+    def stop(self) -> None:
+        if self._stopping.is_set():
+            return
+        app_logger.info("Остановка обработки сообщений")
+        self._stopping.set()
+
+    async def _drain(self, tasks: list[asyncio.Task], timeout: float) -> None:
+        """После stop отменяет чтение из очереди и ждет обработки уже полученных сообщений не дольше timeout."""
+        await self._stopping.wait()
+        await self.rabbit.stop_reading()
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            app_logger.warning(
+                f"За {timeout} с не завершились задач обработки: {len(pending)}, они будут прерваны. "
+                "Их сообщения брокер передоставит, а письма вернет в очередь повтора StaleEmailSweeper"
+            )
+            for task in pending:
+                task.cancel()
+
+    async def _stop_writer(self, writer_task: asyncio.Task) -> None:
+        self.writer.stop()
+        cancelled = False
+        while not writer_task.done():
+            try:
+                await asyncio.shield(writer_task)
+            except asyncio.CancelledError:
+                cancelled = True
+        if cancelled:
+            raise asyncio.CancelledError
+        writer_task.result()
 
     async def run(self):
-        while True:
-            async with self.rabbit as message:
-                if not message or not message.message:
-                    await sleep(1)
-                    continue
-
-                try:
-                    async with self.session_manager() as session:
-                        await self.process_message(session, message)
-                except Exception as e:
-                    app_logger.error(f"Ошибка обработки сообщения: {str(e)}")
+        self._started_at = time.perf_counter()
+        concurrency = self.concurrency
+        if concurrency < self.workers:
+            app_logger.warning(
+                f"Количество обработчиков уменьшено с {self.workers} до {concurrency} по prefetch_count"
+            )
+        app_logger.info("Запуск обработки сообщений, обработчиков: %s", concurrency)
+        writer_task = asyncio.create_task(self.writer.run()) if self.writer else None
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [
+                    group.create_task(self.retry_scheduler.run(self._stopping)),
+                    group.create_task(self.sweeper.run(self._stopping)),
+                    *(group.create_task(self._worker(worker_id)) for worker_id in range(concurrency)),
+                ]
+                group.create_task(self._drain(tasks, settings.shutdown_timeout))
+        finally:
+            # Пишущая задача останавливается последней и дописывает очередь даже при ошибке или отмене:
+            # иначе результаты обработчиков потеряются, а письма останутся в PROCESSING
+            if writer_task:
+                await self._stop_writer(writer_task)
+        app_logger.info("Обработка сообщений остановлена")
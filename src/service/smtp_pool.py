@@ -0,0 +1,375 @@
+import asyncio
+import smtplib
+import ssl
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from email.message import EmailMessage
+from email.utils import getaddresses
+from typing import AsyncIterator, Iterator
+
+from src.app_logger import app_logger
+from src.service.async_smtp import AsyncSMTP
+from src.service.mime_writer import CRLF, PreparedMessage, StreamingMessage
+from src.settings.app import Settings, settings
+
+SMTP_ERRORS = (smtplib.SMTPException, OSError, asyncio.TimeoutError)
+stage_duration = settings.prometheus.metrics.stage_duration
+
+
+def count_smtp_error(error: BaseException) -> None:
+    settings.prometheus.metrics.smtp_errors.labels(error=type(error).__name__).inc()
+
+
+class StaleConnectionError(smtplib.SMTPServerDisconnected):
+    """Соединение из пула оказалось разорвано до команды DATA: письмо сервер точно не получил."""
+
+
+class TrackedSMTP(smtplib.SMTP):
+    """smtplib.SMTP, который помнит, дошла ли текущая транзакция до команды DATA."""
+
+    data_started = False
+
+    def mail(self, sender: str, options: tuple = ()) -> tuple[int, bytes]:
+        self.data_started = False
+        return super().mail(sender, options)
+
+    def data(self, msg: bytes | str) -> tuple[int, bytes]:
+        self.data_started = True
+        return super().data(msg)
+
+
+def send_streaming(
+        server: TrackedSMTP,
+        msg: StreamingMessage,
+        to_addrs: list[str],
+) -> dict[str, tuple[int, bytes]]:
+    """smtplib.SMTP.sendmail, только DATA пишется в сокет кусками StreamingMessage."""
+    from_addr = getaddresses([msg.headers["Sender"] or msg.headers["From"]])[0][1]
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    server.data_started = True
+    code, resp = server.docmd("DATA")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in msg.chunks():
+        server.send(chunk)
+    server.send(b"." + CRLF)
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+def _send_with(server: TrackedSMTP, msg: EmailMessage | StreamingMessage | PreparedMessage, to_addrs: list[str]):
+    if isinstance(msg, PreparedMessage):
+        return server.sendmail(msg.from_addr, to_addrs, msg.data)
+    if isinstance(msg, StreamingMessage):
+        return send_streaming(server, msg, to_addrs)
+    return server.send_message(msg, to_addrs=to_addrs)
+
+
+class PooledSMTP:
+    def __init__(self, server: TrackedSMTP | AsyncSMTP) -> None:
+        self.server = server
+        self.messages = 0
+        # Соединение уже лежало в пуле: сервер мог закрыть его по таймауту простоя
+        self.reused = False
+        self.last_used = time.monotonic()
+
+
+class BaseSMTPPool:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self._idle: deque[PooledSMTP] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        if settings.smtp_tls_verify:
+            self._ssl_context = ssl.create_default_context()
+        else:
+            self._ssl_context = ssl._create_unverified_context()
+
+    def _pop_idle(self) -> PooledSMTP | None:
+        with self._lock:
+            return self._idle.pop() if self._idle else None
+
+    def _idle_for(self, conn: PooledSMTP) -> float:
+        return time.monotonic() - conn.last_used
+
+    def _push_idle(self, conn: PooledSMTP) -> list[PooledSMTP]:
+        """Возвращает соединение в пул, отдает соединения на закрытие."""
+        conn.last_used = time.monotonic()
+        if self._closed or conn.messages >= self.settings.smtp_pool_max_messages:
+            return [conn]
+        expired = []
+        conn.reused = True
+        with self._lock:
+            self._idle.append(conn)
+            deadline = conn.last_used - self.settings.smtp_pool_idle_timeout
+            while self._idle and self._idle[0].last_used < deadline:
+                expired.append(self._idle.popleft())
+        return expired
+
+    def _drain_idle(self) -> list[PooledSMTP]:
+        self._closed = True
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        return idle
+
+
+class SMTPConnectionPool(BaseSMTPPool):
+    """Пул авторизованных SMTP соединений, переиспользуемых между отправками.
+
+    Методы блокирующие и потокобезопасные: пул используется из потоков asyncio.to_thread.
+    """
+
+    def __init__(self, settings: Settings) -> None:
+        super().__init__(settings)
+        self._slots = threading.BoundedSemaphore(settings.smtp_pool_size)
+
+    def _connect(self) -> PooledSMTP:
+        app_logger.debug("Подключение к SMTP %s:%s", self.settings.smtp_host, self.settings.smtp_port)
+        with stage_duration.labels(stage="smtp_connect").time():
+            server = TrackedSMTP(self.settings.smtp_host, self.settings.smtp_port, timeout=self.settings.smtp_timeout)
+        try:
+            if self.settings.smtp_starttls:
+                with stage_duration.labels(stage="smtp_starttls").time():
+                    server.starttls(context=self._ssl_context)
+            with stage_duration.labels(stage="smtp_auth").time():
+                server.login(
+                    self.settings.smtp_user,
+                    self.settings.smtp_password.get_secret_value(),
+                )
+        except Exception:
+            self._quit(server)
+            raise
+        return PooledSMTP(server)
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _is_alive(conn: PooledSMTP) -> bool:
+        try:
+            code, _ = conn.server.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _acquire(self, fresh: bool = False) -> PooledSMTP:
+        while not fresh:
+            conn = self._pop_idle()
+            if conn is None:
+                break
+            idle = self._idle_for(conn)
+            if idle > self.settings.smtp_pool_idle_timeout:
+                self._quit(conn.server)
+                continue
+            if idle > self.settings.smtp_pool_noop_interval and not self._is_alive(conn):
+                conn.server.close()
+                continue
+            return conn
+        return self._connect()
+
+    def _release(self, conn: PooledSMTP) -> None:
+        for stale in self._push_idle(conn):
+            self._quit(stale.server)
+
+    @contextmanager
+    def connection(self, fresh: bool = False) -> Iterator[TrackedSMTP]:
+        with self._slots:
+            conn = self._acquire(fresh=fresh)
+            try:
+                yield conn.server
+            except smtplib.SMTPServerDisconnected as e:
+                conn.server.close()
+                if conn.reused and not conn.server.data_started:
+                    raise StaleConnectionError(*e.args) from e
+                raise
+            except smtplib.SMTPException:
+                # Сервер отклонил транзакцию, соединение можно вернуть после RSET
+                try:
+                    code, _ = conn.server.rset()
+                except (smtplib.SMTPException, OSError):
+                    code = None
+                if code == 250:
+                    self._release(conn)
+                else:
+                    # Без подтвержденного RSET состояние сессии неизвестно, такое соединение в пул не возвращается
+                    conn.server.close()
+                raise
+            except BaseException:
+                conn.server.close()
+                raise
+            else:
+                conn.messages += 1
+                self._release(conn)
+
+    def send_message(
+            self,
+            msg: EmailMessage | StreamingMessage | PreparedMessage,
+            to_addrs: list[str] | None = None,
+    ) -> dict[str, tuple[int, bytes]]:
+        try:
+            return self._send(msg, to_addrs)
+        except SMTP_ERRORS as e:
+            count_smtp_error(e)
+            raise
+
+    def _send(
+            self,
+            msg: EmailMessage | StreamingMessage | PreparedMessage,
+            to_addrs: list[str] | None,
+    ) -> dict[str, tuple[int, bytes]]:
+        try:
+            with self.connection() as server, stage_duration.labels(stage="smtp_send").time():
+                return _send_with(server, msg, to_addrs)
+        except StaleConnectionError as e:
+            # Повтор только для соединения из пула, разорванного до DATA: иначе письмо могло быть принято
+            count_smtp_error(e.__cause__)
+            app_logger.warning(f"SMTP соединение из пула разорвано, повторная отправка через новое соединение: {e}")
+            with self.connection(fresh=True) as server, stage_duration.labels(stage="smtp_send").time():
+                return _send_with(server, msg, to_addrs)
+
+    def close(self) -> None:
+        for conn in self._drain_idle():
+            self._quit(conn.server)
+        app_logger.info("SMTP соединения закрыты")
+
+
+class AsyncSMTPConnectionPool(BaseSMTPPool):
+    """Тот же пул для AsyncSMTP: соединения обслуживаются в event loop без потоков."""
+
+    def __init__(self, settings: Settings) -> None:
+        super().__init__(settings)
+        self._slots = asyncio.BoundedSemaphore(settings.smtp_pool_size)
+
+    async def _connect(self) -> PooledSMTP:
+        app_logger.debug("Подключение к SMTP %s:%s", self.settings.smtp_host, self.settings.smtp_port)
+        server = AsyncSMTP(
+            self.settings.smtp_host,
+            self.settings.smtp_port,
+            timeout=self.settings.smtp_timeout,
+            ssl_context=self._ssl_context,
+        )
+        try:
+            # connect() сразу шлет EHLO: при его ошибке сокет уже открыт и должен быть закрыт
+            with stage_duration.labels(stage="smtp_connect").time():
+                await server.connect()
+            if self.settings.smtp_starttls:
+                with stage_duration.labels(stage="smtp_starttls").time():
+                    await server.starttls()
+            with stage_duration.labels(stage="smtp_auth").time():
+                await server.login(
+                    self.settings.smtp_user,
+                    self.settings.smtp_password.get_secret_value(),
+                )
+        except BaseException:
+            await server.quit()
+            raise
+        return PooledSMTP(server)
+
+    @staticmethod
+    async def _is_alive(conn: PooledSMTP) -> bool:
+        try:
+            code, _ = await conn.server.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    async def _acquire(self, fresh: bool = False) -> PooledSMTP:
+        while not fresh:
+            conn = self._pop_idle()
+            if conn is None:
+                break
+            idle = self._idle_for(conn)
+            if idle > self.settings.smtp_pool_idle_timeout:
+                await conn.server.quit()
+                continue
+            if idle > self.settings.smtp_pool_noop_interval and not await self._is_alive(conn):
+                conn.server.close()
+                continue
+            return conn
+        return await self._connect()
+
+    async def _release(self, conn: PooledSMTP) -> None:
+        for stale in self._push_idle(conn):
+            await stale.server.quit()
+
+    @asynccontextmanager
+    async def connection(self, fresh: bool = False) -> AsyncIterator[AsyncSMTP]:
+        async with self._slots:
+            conn = await self._acquire(fresh=fresh)
+            try:
+                yield conn.server
+            except smtplib.SMTPServerDisconnected as e:
+                conn.server.close()
+                if conn.reused and not conn.server.data_started:
+                    raise StaleConnectionError(*e.args) from e
+                raise
+            except smtplib.SMTPException:
+                try:
+                    code, _ = await conn.server.rset()
+                except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+                    code = None
+                if code == 250:
+                    await self._release(conn)
+                else:
+                    # Без подтвержденного RSET состояние сессии неизвестно, такое соединение в пул не возвращается
+                    conn.server.close()
+                raise
+            except BaseException:
+                conn.server.close()
+                raise
+            else:
+                conn.messages += 1
+                await self._release(conn)
+
+    async def send_message(
+            self,
+            msg: EmailMessage | StreamingMessage | PreparedMessage,
+            to_addrs: list[str] | None = None,
+    ) -> dict[str, tuple[int, str]]:
+        try:
+            return await self._send(msg, to_addrs)
+        except SMTP_ERRORS as e:
+            count_smtp_error(e)
+            raise
+
+    async def _send(
+            self,
+            msg: EmailMessage | StreamingMessage | PreparedMessage,
+            to_addrs: list[str] | None,
+    ) -> dict[str, tuple[int, str]]:
+        try:
+            async with self.connection() as server:
+                with stage_duration.labels(stage="smtp_send").time():
+                    return await server.send_message(msg, to_addrs=to_addrs)
+        except StaleConnectionError as e:
+            count_smtp_error(e.__cause__)
+            app_logger.warning(f"SMTP соединение из пула разорвано, повторная отправка через новое соединение: {e}")
+            async with self.connection(fresh=True) as server:
+                with stage_duration.labels(stage="smtp_send").time():
+                    return await server.send_message(msg, to_addrs=to_addrs)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(conn.server.quit() for conn in self._drain_idle()))
+        app_logger.info("Асинхронные SMTP соединения закрыты")
+
+
+smtp_pool = SMTPConnectionPool(settings)
+async_smtp_pool = AsyncSMTPConnectionPool(settings)
@@ -0,0 +1,81 @@
+import asyncio
+from contextlib import suppress
+from datetime import timedelta
+
+from sqlalchemy import case, cast, func, literal, select, update
+
+from src.app_logger import app_logger
+from src.database.models.email_data import EmailData, StatusType
+from src.database.postgres import SessionManager
+from src.settings.app import settings
+
+
+class StaleEmailSweeper:
+    """Фоновая задача, возвращающая в очередь повторов письма, брошенные упавшим процессом.
+
+    Письмо в NEW или PROCESSING, статус которого не менялся дольше processing_lease,
+    переводится в RETRY с немедленным next_attempt_at, дальше его отправляет RetryScheduler.
+    Строки захватываются пачками через FOR UPDATE SKIP LOCKED, поэтому несколько экземпляров
+    сервиса не мешают друг другу. Письмо, исчерпавшее попытки, переводится в ERROR.
+    """
+
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        lease: int = settings.processing_lease,
+        batch_size: int = settings.sweeper_batch_size,
+        interval: int = settings.sweeper_interval,
+    ):
+        self.session_manager = session_manager
+        self.lease = timedelta(seconds=lease)
+        self.batch_size = batch_size
+        self.interval = interval
+
+    async def reclaim(self) -> int:
+        stale = (
+            select(EmailData.id)
+            .where(
+                EmailData.status.in_([StatusType.NEW, StatusType.PROCESSING]),
+                EmailData.updated_at < func.now() - self.lease,
+            )
+            .order_by(EmailData.updated_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        status_type = EmailData.status.type
+        async with self.session_manager() as session:
+            result = await session.execute(
+                update(EmailData)
+                .where(EmailData.id.in_(stale.scalar_subquery()))
+                .values(
+                    status=cast(
+                        case(
+                            (EmailData.attempts >= settings.email_max_retries, literal(StatusType.ERROR, status_type)),
+                            else_=literal(StatusType.RETRY, status_type),
+                        ),
+                        status_type,
+                    ),
+                    attempts=EmailData.attempts + 1,
+                    next_attempt_at=func.now(),
+                    error="Обработка письма прервана",
+                )
+                .returning(EmailData.status)
+            )
+            statuses = result.scalars().all()
+        if statuses:
+            failed = statuses.count(StatusType.ERROR)
+            settings.prometheus.metrics.emails_status.labels(status=StatusType.RETRY.value).inc(len(statuses) - failed)
+            settings.prometheus.metrics.emails_status.labels(status=StatusType.ERROR.value).inc(failed)
+            app_logger.warning(f"Возвращено брошенных писем: {len(statuses) - failed}, в ошибку: {failed}")
+        return len(statuses)
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        while not stopping.is_set():
+            try:
+                reclaimed = await self.reclaim()
+            except Exception as e:
+                app_logger.error(f"Ошибка при поиске брошенных писем: {e}")
+                reclaimed = 0
+            if reclaimed < self.batch_size:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stopping.wait(), timeout=self.interval)
@@ -1,4 +1,5 @@
 import logging
+from typing import Literal
 
 from pydantic import Field, SecretStr, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -13,7 +14,94 @@ class Settings(BaseSettings):
         default="WARNING",
         description=f"One of {', '.join(logging._nameToLevel.copy())}",
     )
+    log_format: Literal["text", "json"] = Field(
+        default="text",
+        description="text - строки для чтения глазами, json - одна JSON запись на строку",
+    )
+    log_async: bool = Field(
+        default=False,
+        description="Писать логи из отдельного потока через QueueHandler/QueueListener",
+    )
+    log_queue_size: int = Field(
+        default=10000,
+        description="Размер очереди логов в режиме log_async, при переполнении записи отбрасываются",
+    )
+    log_sample_rate: float = Field(
+        default=1.0,
+        description="Доля сообщений, для которых пишутся INFO/DEBUG логи обработки, WARNING и выше пишутся всегда",
+    )
     timeout_for_repeat_read: int = 30
+    workers: int = Field(
+        default=1,
+        description="Количество одновременно обрабатываемых сообщений, ограничено rabbit.prefetch_count",
+    )
+    processes: int = Field(
+        default=1,
+        description="Сколько процессов запускает src.supervisor, 0 - по числу ядер",
+    )
+    shutdown_timeout: int = Field(
+        default=30,
+        description="Сколько секунд при остановке дается на обработку уже полученных сообщений",
+    )
+    postgres_connection_budget: int | None = Field(
+        default=None,
+        description="Сколько соединений Postgres делят процессы, по умолчанию 80% от max_connections",
+    )
+
+    templates_auto_reload: bool = Field(
+        default=False,
+        description="Проверять изменения файлов шаблонов при каждом обращении",
+    )
+    templates_bytecode_cache_dir: str | None = Field(
+        default=None,
+        description="Каталог для байткода скомпилированных шаблонов, переживает перезапуск",
+    )
+    templates_precompiled_dir: str | None = Field(
+        default=None,
+        description="Каталог шаблонов, заранее скомпилированных командой python -m src.service.renderer",
+    )
+    render_mode: Literal["inline", "process", "auto"] = Field(
+        default="inline",
+        description="inline - рендер в event loop, process - в пуле процессов, auto - в пуле только тяжелые шаблоны",
+    )
+    render_processes: int | None = Field(
+        default=None,
+        description="Размер пула процессов для рендера, по умолчанию по числу ядер",
+    )
+    render_process_min_template_bytes: int = Field(
+        default=32768,
+        description="В режиме auto шаблоны с исходником от этого размера рендерятся в пуле процессов",
+    )
+    render_process_min_context_bytes: int = Field(
+        default=65536,
+        description="В режиме auto контекст от этого размера в JSON рендерится в пуле процессов",
+    )
+    render_cache_max_bytes: int = Field(
+        default=32 * 1024 * 1024,
+        description="Память под кеш отрендеренных писем, 0 - кеш выключен",
+    )
+    render_cache_ttl: int = Field(
+        default=300,
+        description="Сколько секунд отрендеренное письмо живет в кеше",
+    )
+    body_storage: Literal["row", "shared"] = Field(
+        default="row",
+        description="row - тело письма хранится в каждой строке email_data, shared - один раз в email_body по хешу",
+    )
+    attachment_storage: Literal["inline", "filesystem", "s3"] = Field(
+        default="inline",
+        description="inline - вложения в base64 в email_data, filesystem/s3 - в хранилище по SHA-256, в строке ссылка",
+    )
+    attachments_dir: str = Field(
+        default="attachments",
+        description="Каталог хранилища вложений для attachment_storage=filesystem",
+    )
+    attachments_s3_bucket: str | None = None
+    attachments_s3_prefix: str = "attachments/"
+    attachments_s3_endpoint_url: str | None = Field(
+        default=None,
+        description="Адрес S3-совместимого хранилища, ключи доступа берутся из стандартных переменных AWS_*",
+    )
 
     s3_url: str = "https://your-s3-endpoint/"
     base_url: str = "https://base.com/"
@@ -25,11 +113,138 @@ class Settings(BaseSettings):
     smtp_user: str = "ff"
     smtp_host: str = 'smtp.zeptomail.com'
     smtp_port: int = 587
+    smtp_timeout: int = 30
+    smtp_starttls: bool = Field(
+        default=True,
+        description="Включать шифрование командой STARTTLS, отключается только для локальных релеев и тестов",
+    )
+    smtp_tls_verify: bool = True
+    smtp_transport: Literal["asyncio", "thread"] = Field(
+        default="asyncio",
+        description="asyncio - SMTP клиент в event loop, thread - smtplib в потоках asyncio.to_thread",
+    )
+    smtp_max_recipients: int = Field(
+        default=50,
+        description="Сколько получателей рассылки одного домена отправлять одной транзакцией SMTP",
+    )
+    smtp_rate_limit: float = Field(
+        default=0,
+        description="Писем в секунду на SMTP аккаунт, 0 - без ограничения",
+    )
+    smtp_rate_burst: int = 10
+    domain_rate_limit: float = Field(
+        default=0,
+        description="Писем в секунду на домен получателя по умолчанию, 0 - без ограничения",
+    )
+    domain_rate_limits: dict[str, float] = Field(
+        default_factory=dict,
+        description='Скорость для отдельных доменов, JSON вида {"gmail.com": 20}',
+    )
+    domain_rate_burst: int = 5
+    rate_limit_max_wait: float = Field(
+        default=1.0,
+        description="Сколько секунд обработчик ждет токен домена, при большем ожидании письмо откладывается",
+    )
+    smtp_pool_size: int = Field(
+        default=4,
+        description="Максимум одновременно открытых SMTP соединений",
+    )
+    smtp_pool_max_messages: int = Field(
+        default=100,
+        description="Сколько писем отправляется через одно соединение до переподключения",
+    )
+    smtp_pool_idle_timeout: int = Field(
+        default=60,
+        description="Через сколько секунд простоя соединение закрывается",
+    )
+    smtp_pool_noop_interval: int = Field(
+        default=10,
+        description="После скольких секунд простоя соединение проверяется командой NOOP",
+    )
+
+    email_max_retries: int = Field(
+        default=3,
+        description="Сколько раз повторять отправку после ошибки SMTP",
+    )
+    email_max_deferrals: int = Field(
+        default=10,
+        description="Сколько раз письмо откладывается по ответу сервера 421/451, дальше ответ тратит попытку",
+    )
+    email_retry_delay: int = Field(
+        default=5,
+        description="Базовая задержка повтора в секундах, удваивается с каждой попыткой",
+    )
+    retry_poll_interval: int = Field(
+        default=5,
+        description="Как часто в секундах искать письма, которым пора повторить отправку",
+    )
+    retry_batch_size: int = 100
+    processing_lease: int = Field(
+        default=600,
+        description="Через сколько секунд без смены статуса письмо в NEW/PROCESSING считается брошенным",
+    )
+    sweeper_interval: int = Field(
+        default=60,
+        description="Как часто в секундах искать брошенные письма",
+    )
+    sweeper_batch_size: int = 500
+
+    idempotency_cache_size: int = Field(
+        default=100000,
+        description="Сколько последних ключей идемпотентности помнить в памяти, 0 - проверять только в Postgres",
+    )
+
+    db_batching: bool = Field(
+        default=False,
+        description="Писать вставки и смены статусов EmailData пачками",
+    )
+    db_batch_size: int = 100
+    db_batch_max_latency_ms: int = Field(
+        default=20,
+        description="Сколько миллисекунд пачка может ждать заполнения перед записью",
+    )
 
     rabbit: RabbitSettings = RabbitSettings()
     postgres: PostgresSettings = PostgresSettings()
     prometheus: PrometheusSettings = PrometheusSettings()
 
+    @field_validator(
+        "workers",
+        "shutdown_timeout",
+        "log_queue_size",
+        "smtp_timeout",
+        "smtp_pool_size",
+        "smtp_pool_max_messages",
+        "smtp_max_recipients",
+        "smtp_rate_burst",
+        "domain_rate_burst",
+        "email_max_deferrals",
+        "email_retry_delay",
+        "retry_poll_interval",
+        "retry_batch_size",
+        "processing_lease",
+        "sweeper_interval",
+        "sweeper_batch_size",
+        "db_batch_size",
+        "db_batch_max_latency_ms",
+    )
+    def validate_positive(cls, v: int) -> int:
+        if v <= 0:
+            raise ValueError("Значение должно быть положительным числом")
+        return v
+
+    @field_validator("processes")
+    def validate_processes(cls, v: int) -> int:
+        if v < 0:
+            raise ValueError("Значение не может быть отрицательным")
+        return v
+
+    @field_validator("log_sample_rate")
+    def validate_log_sample_rate(cls, v: float) -> float:
+        if not 0 <= v <= 1:
+            raise ValueError("Доля должна быть от 0 до 1")
+        return v
+
     @field_validator("log_level", mode="before")
     def validate_log_level(cls, v: str) -> str:
         if v not in logging._nameToLevel.copy():
@@ -1,4 +1,4 @@
-from prometheus_client import Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,11 +7,49 @@ class PrometheusMetrics:
         name="handle_message_duration",
         documentation="Время обработки одного сообщения",
     )
+    stage_duration = Histogram(
+        name="stage_duration",
+        documentation=(
+            "Время этапов обработки: receive, decode, db_insert, smtp_connect, smtp_starttls, smtp_auth, smtp_send, ack"
+        ),
+        labelnames=["stage"],
+    )
+    messages_in_flight = Gauge(
+        name="messages_in_flight",
+        documentation="Сообщения RabbitMQ, которые сейчас обрабатываются",
+    )
+    emails_status = Counter(
+        name="emails_status",
+        documentation="Смены статуса писем на итоговый: processed, retry, error",
+        labelnames=["status"],
+    )
+    smtp_errors = Counter(
+        name="smtp_errors",
+        documentation="Ошибки SMTP по классу исключения",
+        labelnames=["error"],
+    )
+    db_pool_checked_out = Gauge(
+        name="db_pool_checked_out",
+        documentation="Соединения Postgres, выданные из пула",
+    )
+    render_duration = Histogram(
+        name="render_duration",
+        documentation="Время рендера шаблона письма",
+        labelnames=["mode"],
+    )
+    render_cache_hits = Counter(
+        name="render_cache_hits",
+        documentation="Письма, взятые из кеша рендера",
+    )
+    render_cache_misses = Counter(
+        name="render_cache_misses",
+        documentation="Письма, которых не было в кеше рендера",
+    )
 
 
 class PrometheusSettings(BaseSettings):
+    enabled: bool = True
     port: int = 9105
-    endpoint: str = "/metrics"
     metrics: PrometheusMetrics = PrometheusMetrics()
 
     model_config = SettingsConfigDict(env_prefix="EMAIL_SERVICE_PROMETHEUS_", case_sensitive=False)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, Literal
 
 from aio_pika import ExchangeType
 from pydantic import BaseModel, Field, SecretStr, field_validator, model_validator
@@ -47,6 +47,18 @@ class RabbitSettings(BaseSettings):
     timeout_seconds: int = 30
     max_retries: int = 5
     retry_delay_seconds: int = 1
+    ack_batch_size: int = Field(
+        default=1,
+        description="Сколько подтверждений копить для ack(multiple=True), не больше prefetch_count / 2",
+    )
+    ack_max_delay_ms: int = Field(
+        default=50,
+        description="Сколько миллисекунд подтверждение может ждать пачку",
+    )
+    read_mode: Literal["consume", "get"] = Field(
+        default="consume",
+        description="consume - брокер присылает сообщения сам (basic.consume), get - опрос очереди (basic.get)",
+    )
 
     queue: QueueConfig = Field(
         default_factory=lambda: QueueConfig(name="email_queue")
@@ -64,6 +76,8 @@ class RabbitSettings(BaseSettings):
         "timeout_seconds",
         "max_retries",
         "retry_delay_seconds",
+        "ack_batch_size",
+        "ack_max_delay_ms",
     )
     def validate_positive_ints(cls, v):
         if v <= 0:
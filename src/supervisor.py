@@ -0,0 +1,155 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import orjson
+import psycopg
+
+from src.app_logger import app_logger
+from src.settings.app import Settings, settings
+
+# Доля max_connections Postgres, которую занимают процессы сервиса; остальное - миграциям и другим клиентам
+CONNECTION_SHARE = 0.8
+RESPAWN_MAX_DELAY = 30
+# Процесс, проживший меньше, считается упавшим при запуске: перезапуск откладывается
+MIN_UPTIME = 10
+
+
+def connection_budget(settings: Settings) -> int | None:
+    """Сколько соединений Postgres могут занять все процессы вместе."""
+    if settings.postgres_connection_budget:
+        return settings.postgres_connection_budget
+    pg = settings.postgres
+    try:
+        with psycopg.connect(
+            host=pg.host,
+            port=pg.port,
+            dbname=pg.dbname,
+            user=pg.user,
+            password=pg.password.get_secret_value(),
+            connect_timeout=pg.pool_timeout,
+        ) as connection:
+            max_connections = int(connection.execute("SHOW max_connections").fetchone()[0])
+            reserved = int(connection.execute("SHOW superuser_reserved_connections").fetchone()[0])
+    except psycopg.Error as e:
+        app_logger.warning(f"Не удалось узнать max_connections Postgres, размеры пулов не делятся: {e}")
+        return None
+    return int((max_connections - reserved) * CONNECTION_SHARE)
+
+
+def worker_environment(settings: Settings, processes: int, budget: int | None) -> dict[str, str]:
+    """Переменные окружения процесса-обработчика: общие лимиты делятся на число процессов."""
+    env = {
+        "EMAIL_SERVICE_PROCESSES": "1",
+        "EMAIL_SERVICE_SMTP_POOL_SIZE": str(max(1, settings.smtp_pool_size // processes)),
+        "EMAIL_SERVICE_RENDER_PROCESSES": str(max(1, (settings.render_processes or os.cpu_count() or 1) // processes)),
+        "EMAIL_SERVICE_SMTP_RATE_LIMIT": str(settings.smtp_rate_limit / processes),
+        "EMAIL_SERVICE_DOMAIN_RATE_LIMIT": str(settings.domain_rate_limit / processes),
+        "EMAIL_SERVICE_DOMAIN_RATE_LIMITS": orjson.dumps(
+            {domain: rate / processes for domain, rate in settings.domain_rate_limits.items()}
+        ).decode(),
+    }
+    if budget is not None:
+        per_process = max(1, budget // processes)
+        pool_size = min(settings.postgres.pool_size, per_process)
+        env["EMAIL_SERVICE_POSTGRES_POOL_SIZE"] = str(pool_size)
+        env["EMAIL_SERVICE_POSTGRES_MAX_OVERFLOW"] = str(min(settings.postgres.max_overflow, per_process - pool_size))
+    return env
+
+
+class Worker:
+    def __init__(self, index: int, env: dict[str, str]) -> None:
+        self.index = index
+        self.env = env
+        self.process: subprocess.Popen | None = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at = 0.0
+
+    def start(self) -> None:
+        env = {
+            **os.environ,
+            **self.env,
+            # У каждого процесса свой порт метрик
+            "EMAIL_SERVICE_PROMETHEUS_PORT": str(settings.prometheus.port + self.index),
+        }
+        self.process = subprocess.Popen([sys.executable, "-m", "src.main"], env=env)
+        self.started_at = time.monotonic()
+        app_logger.info(f"Процесс {self.index} запущен, pid {self.process.pid}")
+
+    def check(self) -> None:
+        """Перезапускает завершившийся процесс, при частых падениях - с нарастающей задержкой."""
+        now = time.monotonic()
+        if self.process is None:
+            if now >= self.restart_at:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        self.crashes = self.crashes + 1 if now - self.started_at < MIN_UPTIME else 0
+        delay = min(RESPAWN_MAX_DELAY, 2 ** self.crashes - 1)
+        app_logger.error(f"Процесс {self.index} (pid {self.process.pid}) завершился с кодом {code}, "
+                         f"перезапуск через {delay} с")
+        self.process = None
+        self.restart_at = now + delay
+
+
+class Supervisor:
+    """Запускает несколько процессов src.main, перезапускает упавшие и останавливает их по SIGTERM/SIGINT.
+
+    У каждого процесса свой канал AMQP и пул Postgres. Пул Postgres, пул SMTP и лимиты скорости
+    делятся между процессами, чтобы их сумма не превышала общие ограничения.
+    """
+
+    def __init__(self, processes: int) -> None:
+        self.processes = processes
+        self._stopping = False
+
+    def _stop(self, signum: int, frame: object) -> None:
+        app_logger.info(f"Получен сигнал {signal.Signals(signum).name}, остановка процессов")
+        self._stopping = True
+
+    def run(self) -> int:
+        budget = connection_budget(settings)
+        env = worker_environment(settings, self.processes, budget)
+        app_logger.info(f"Запуск {self.processes} процессов, лимиты процесса: {env}")
+        workers = [Worker(index, env) for index in range(self.processes)]
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        while not self._stopping:
+            for worker in workers:
+                worker.check()
+            time.sleep(1)
+
+        running = [worker.process for worker in workers if worker.process and worker.process.poll() is None]
+        for process in running:
+            process.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + settings.shutdown_timeout + 5
+        for process in running:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                app_logger.error(f"Процесс {process.pid} не остановился за {settings.shutdown_timeout} с, SIGKILL")
+                process.kill()
+                process.wait()
+        app_logger.info("Все процессы остановлены")
+        return 0
+
+
+def main() -> int:
+    processes = settings.processes or os.cpu_count() or 1
+    if processes == 1:
+        from src.main import main as run_service
+
+        asyncio.run(run_service())
+        return 0
+    return Supervisor(processes).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
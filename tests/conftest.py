@@ -0,0 +1,19 @@
+import asyncio
+import inspect
+import os
+
+import pytest
+
+# Настройки сервиса читаются при импорте модулей src, поэтому окружение готовится до импорта
+os.environ.setdefault("EMAIL_SERVICE_EMAIL_FROM", "Сервис рассылок <sender@example.com>")
+os.environ.setdefault("EMAIL_SERVICE_ATTACHMENT_STORAGE", "inline")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem: pytest.Function) -> bool | None:
+    """Запускает async def тесты в отдельном event loop, без плагина pytest-asyncio."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
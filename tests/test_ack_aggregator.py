@@ -0,0 +1,111 @@
+import asyncio
+
+from src.database.rabbit import AckAggregator
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.is_closed = False
+        self.log: list[tuple] = []
+
+
+class FakeMessage:
+    def __init__(self, channel: FakeChannel, delivery_tag: int, ack_delay: float = 0) -> None:
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.ack_delay = ack_delay
+
+    async def ack(self, multiple: bool = False) -> None:
+        if self.ack_delay:
+            await asyncio.sleep(self.ack_delay)
+        self.channel.log.append(("ack", self.delivery_tag, multiple))
+
+    async def nack(self, requeue: bool = False) -> None:
+        self.channel.log.append(("nack", self.delivery_tag, requeue))
+
+
+def tracked(aggregator: AckAggregator, channel: FakeChannel, count: int, **kwargs) -> list[FakeMessage]:
+    messages = [FakeMessage(channel, tag, **kwargs) for tag in range(1, count + 1)]
+    for message in messages:
+        aggregator.track(message)
+    return messages
+
+
+async def test_contiguous_prefix_is_acked_with_multiple():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=3, max_delay=10)
+    for message in tracked(aggregator, channel, 3):
+        await aggregator.ack(message)
+
+    assert channel.log == [("ack", 3, True)]
+    assert aggregator._pending == {}
+
+
+async def test_gap_in_prefix_acks_the_rest_one_by_one():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=3, max_delay=10)
+    messages = tracked(aggregator, channel, 5)
+    for message in (messages[0], messages[2], messages[4]):
+        await aggregator.ack(message)
+
+    assert channel.log == [("ack", 1, True), ("ack", 3, False), ("ack", 5, False)]
+    assert aggregator._pending[channel] == {2: None, 4: None}
+
+
+async def test_nack_is_sent_immediately_and_does_not_block_the_prefix():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=2, max_delay=10)
+    messages = tracked(aggregator, channel, 3)
+    await aggregator.ack(messages[1])
+    await aggregator.nack(messages[0])
+    await aggregator.ack(messages[2])
+
+    assert channel.log == [("nack", 1, False), ("ack", 3, True)]
+
+
+async def test_timer_flushes_partial_batch():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=100, max_delay=0.01)
+    messages = tracked(aggregator, channel, 2)
+    await aggregator.ack(messages[0])
+    assert channel.log == []
+
+    await asyncio.sleep(0.05)
+    assert channel.log == [("ack", 1, True)]
+    assert aggregator._timer is None
+
+
+async def test_concurrent_flushes_ack_each_message_once():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=100, max_delay=10)
+    messages = tracked(aggregator, channel, 5, ack_delay=0.01)
+    for message in (messages[1], messages[3]):
+        await aggregator.ack(message)
+    await asyncio.gather(aggregator.flush(), aggregator.flush(), aggregator.flush())
+
+    assert channel.log == [("ack", 2, False), ("ack", 4, False)]
+    assert aggregator._pending[channel] == {1: None, 3: None, 5: None}
+
+
+async def test_closed_channel_is_dropped_without_acks():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=100, max_delay=10)
+    messages = tracked(aggregator, channel, 2)
+    await aggregator.ack(messages[0])
+    channel.is_closed = True
+    await aggregator.flush()
+    await aggregator.nack(messages[1])
+
+    assert channel.log == []
+    assert aggregator._pending == {}
+
+
+async def test_discard_releases_the_prefix():
+    channel = FakeChannel()
+    aggregator = AckAggregator(batch_size=100, max_delay=10)
+    messages = tracked(aggregator, channel, 2)
+    await aggregator.ack(messages[1])
+    aggregator.discard(messages[0])
+    await aggregator.flush()
+
+    assert channel.log == [("ack", 2, True)]
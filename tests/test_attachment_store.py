@@ -0,0 +1,62 @@
+import base64
+import hashlib
+
+import pytest
+
+from src.service.attachment_store import FileSystemAttachmentStore, _inline_chunks, checked_digest
+
+DIGEST = hashlib.sha256(b"data").hexdigest()
+
+
+@pytest.mark.parametrize("digest", [
+    "../../etc/passwd",
+    f"../{DIGEST[3:]}",
+    DIGEST[:-1],
+    DIGEST + "0",
+    DIGEST.upper(),
+    f"{DIGEST[:-1]}g",
+    "",
+    None,
+])
+def test_bad_digest_is_rejected(digest):
+    with pytest.raises(ValueError):
+        checked_digest(digest)
+
+
+def test_filesystem_store_rejects_paths(tmp_path):
+    store = FileSystemAttachmentStore(str(tmp_path / "store"))
+    for operation in (store.exists, store.read, lambda digest: store.write(digest, b"x")):
+        with pytest.raises(ValueError):
+            operation("../../etc/passwd")
+    assert not (tmp_path / "store").exists()
+
+
+def test_filesystem_store_round_trip(tmp_path):
+    store = FileSystemAttachmentStore(str(tmp_path))
+    data = bytes(range(256)) * 100
+    digest = store.put(data)
+
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert (tmp_path / digest[:2] / digest).read_bytes() == data
+    assert store.exists(digest)
+    assert store.read(digest) == data
+    assert b"".join(bytes(chunk) for chunk in store.chunks(digest, 1000)) == data
+    assert [path.name for path in tmp_path.rglob("*") if path.is_file()] == [digest]
+
+
+def test_filesystem_store_keeps_one_copy(tmp_path):
+    store = FileSystemAttachmentStore(str(tmp_path))
+    refs = store.store([
+        {"filename": "a.txt", "content": base64.b64encode(b"same").decode()},
+        {"filename": "b.txt", "content": base64.b64encode(b"same").decode()},
+    ])
+
+    assert [ref["filename"] for ref in refs] == ["a.txt", "b.txt"]
+    assert refs[0]["sha256"] == refs[1]["sha256"]
+    assert refs[0]["size"] == 4
+    assert len([path for path in tmp_path.rglob("*") if path.is_file()]) == 1
+
+
+@pytest.mark.parametrize("content", [base64.b64encode(bytes(range(200))).decode(), "AAEC\nAwQF"])
+def test_inline_chunks_decode_base64(content):
+    assert b"".join(_inline_chunks(content, 30)) == base64.b64decode(content)
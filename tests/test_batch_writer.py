@@ -0,0 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from src.database import batch_writer
+from src.database.batch_writer import EmailDataBatchWriter
+from src.database.models.email_data import StatusType
+
+
+class FakeSessionManager:
+    def __init__(self) -> None:
+        self.transactions: list[list[dict]] = []
+
+    @asynccontextmanager
+    async def __call__(self):
+        rows: list[dict] = []
+        yield rows
+        self.transactions.append(rows)
+
+
+@pytest.fixture
+def session_manager(monkeypatch) -> FakeSessionManager:
+    async def insert_emails(session, rows):
+        if any(row["address"] == "bad" for row in rows):
+            raise ValueError("bad row")
+        session.extend(rows)
+        return list(range(len(session) - len(rows), len(session)))
+
+    async def update(session, rows):
+        session.extend({"update": email_id} for email_id, _, _ in rows)
+
+    monkeypatch.setattr(batch_writer, "insert_emails", insert_emails)
+    monkeypatch.setattr(EmailDataBatchWriter, "_update", staticmethod(update))
+    return FakeSessionManager()
+
+
+async def test_batch_is_written_in_one_transaction(session_manager):
+    writer = EmailDataBatchWriter(session_manager, batch_size=100, max_latency=10)
+    results = asyncio.gather(
+        writer.insert({"address": "a"}), writer.insert({"address": "b"}), writer.update_status(7, StatusType.PROCESSED)
+    )
+    await asyncio.sleep(0)
+    await writer.flush()
+
+    assert await results == [0, 1, None]
+    assert session_manager.transactions == [[{"address": "a"}, {"address": "b"}, {"update": 7}]]
+
+
+async def test_failed_batch_fails_only_the_bad_entry(session_manager):
+    writer = EmailDataBatchWriter(session_manager, batch_size=100, max_latency=10)
+    results = asyncio.gather(
+        writer.insert({"address": "a"}),
+        writer.insert({"address": "bad"}),
+        writer.update_status(7, StatusType.PROCESSED),
+        return_exceptions=True,
+    )
+    await asyncio.sleep(0)
+    await writer.flush()
+
+    good, bad, updated = await results
+    assert (good, updated) == (0, None)
+    assert isinstance(bad, ValueError)
+    assert session_manager.transactions == [[{"address": "a"}], [{"update": 7}]]
@@ -0,0 +1,80 @@
+import smtplib
+
+import pytest
+
+from src.service import email_sender
+from src.service.email_sender import OutgoingEmail, _deliver_email, domain_chunks, is_throttling, throttled_delay
+from src.settings.app import settings
+
+
+def outgoing(*addresses: str) -> list[OutgoingEmail]:
+    return [OutgoingEmail(index, address, "Subject", "text", None, None) for index, address in enumerate(addresses)]
+
+
+def addresses(chunks: list[list[OutgoingEmail]]) -> list[list[str]]:
+    return [[email.address for email in chunk] for chunk in chunks]
+
+
+def test_domain_chunks_group_by_domain_in_first_seen_order():
+    emails = outgoing("a@x.com", "b@y.com", "c@X.COM", "d@y.com", "e@z.com")
+    assert addresses(domain_chunks(emails, 10)) == [["a@x.com", "c@X.COM"], ["b@y.com", "d@y.com"], ["e@z.com"]]
+
+
+def test_domain_chunks_split_by_step():
+    emails = outgoing(*(f"user{i}@x.com" for i in range(5)), "other@y.com")
+    assert [len(chunk) for chunk in domain_chunks(emails, 2)] == [2, 2, 1, 1]
+
+
+def test_domain_chunks_keep_every_email_once():
+    emails = outgoing(*(f"user{i}@domain{i % 3}.com" for i in range(10)))
+    chunks = domain_chunks(emails, 3)
+
+    assert sorted(email.id for chunk in chunks for email in chunk) == list(range(10))
+    assert all(len({email.address.split("@")[1] for email in chunk}) == 1 for chunk in chunks)
+    assert domain_chunks([], 3) == []
+
+
+def test_connect_errors_are_not_throttling():
+    assert is_throttling(smtplib.SMTPDataError(451, "try later"))
+    assert is_throttling(smtplib.SMTPSenderRefused(421, "too many messages", "sender@example.com"))
+    assert not is_throttling(smtplib.SMTPConnectError(421, "service not available"))
+    assert not is_throttling(smtplib.SMTPHeloError(421, "closing"))
+    assert not is_throttling(smtplib.SMTPDataError(550, "rejected"))
+
+
+def test_throttled_delay_doubles_with_deferrals():
+    base = settings.email_retry_delay
+    assert [throttled_delay("user@example.com", deferrals) for deferrals in (1, 2, 3)] == [base, 2 * base, 4 * base]
+
+
+@pytest.fixture
+def outcomes(monkeypatch) -> list[tuple]:
+    calls = []
+
+    async def send_email(**kwargs):
+        raise smtplib.SMTPDataError(451, "try later")
+
+    async def defer_email(session_manager, email_id, delay, reason, throttled=False):
+        calls.append(("defer", email_id, throttled))
+
+    async def schedule_retry(session_manager, email_id, attempts, error):
+        calls.append(("retry", email_id, attempts))
+
+    monkeypatch.setattr(email_sender, "send_email", send_email)
+    monkeypatch.setattr(email_sender, "defer_email", defer_email)
+    monkeypatch.setattr(email_sender, "schedule_retry", schedule_retry)
+    return calls
+
+
+async def test_throttling_defers_without_spending_an_attempt(outcomes):
+    email = OutgoingEmail(1, "user@example.com", "Subject", "text", None, None, attempts=0, deferrals=2)
+    await _deliver_email(None, email, None)
+    assert outcomes == [("defer", 1, True)]
+
+
+async def test_throttling_spends_attempts_after_max_deferrals(outcomes):
+    email = OutgoingEmail(
+        1, "user@example.com", "Subject", "text", None, None, attempts=0, deferrals=settings.email_max_deferrals
+    )
+    await _deliver_email(None, email, None)
+    assert outcomes == [("retry", 1, 1)]
@@ -0,0 +1,45 @@
+from src.database.rabbit import EmailMessage, MessageInfo, RabbitMessageMeta
+from src.service.idempotency import RecentKeys, idempotency_key, recipient_key
+
+
+def test_recent_keys_evict_least_recently_used():
+    keys = RecentKeys(max_size=2)
+    keys.add("a")
+    keys.add("b")
+    assert "a" in keys
+    keys.add("c")
+
+    assert "a" in keys
+    assert "b" not in keys
+    assert "c" in keys
+
+
+def test_recent_keys_re_adding_refreshes_the_key():
+    keys = RecentKeys(max_size=2)
+    for key in ("a", "b", "a", "c"):
+        keys.add(key)
+
+    assert ("a" in keys, "b" in keys, "c" in keys) == (True, False, True)
+
+
+def test_recent_keys_disabled():
+    keys = RecentKeys(max_size=0)
+    keys.add("a")
+    assert "a" not in keys
+
+
+def test_recipient_key_fits_the_column():
+    key = recipient_key("k" * 255, "user@" + "x" * 250 + ".com")
+    assert len(key) == 64
+    assert key == recipient_key("k" * 255, "user@" + "x" * 250 + ".com")
+    assert recipient_key("k", "a@example.com") != recipient_key("k", "b@example.com")
+
+
+def test_idempotency_key_falls_back_to_message_id():
+    meta = RabbitMessageMeta(message_id="amqp-id")
+    keyed = MessageInfo(message=EmailMessage(to="a@example.com", subject="s", idempotency_key="own"), message_meta=meta)
+    plain = MessageInfo(message=EmailMessage(to="a@example.com", subject="s"), message_meta=meta)
+
+    assert idempotency_key(keyed) == "own"
+    assert idempotency_key(plain) == "amqp-id"
+    assert idempotency_key(MessageInfo(message=plain.message, message_meta=RabbitMessageMeta())) is None
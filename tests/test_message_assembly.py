@@ -0,0 +1,204 @@
+import base64
+import random
+import re
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.policy import default
+
+import pytest
+
+from src.service.message_assembly import (
+    build_message,
+    envelope_recipients,
+    guess_mime_type,
+    header_line,
+    prepare_message,
+)
+from src.service.mime_writer import ATTACHMENT_CHUNK_SIZE, StreamingMessage, encode_base64, quote_data
+from src.settings.app import settings
+
+LONG_LINE = "x" * 1500
+TEXTS = {
+    "ascii": "Hello!\nYour order #12345 has been shipped.\n",
+    "unicode": "Здравствуйте!\nВаш заказ №12345 отправлен.\n",
+    "long line": f"start\n{LONG_LINE}\nend\n",
+    "leading dots": ".\n.hidden\n..double\nnot.a dot\n.",
+    "crlf": "one\r\ntwo\rthree\n",
+}
+HTML = "<html><body><p>Заказ отправлен</p><p>.точка</p></body></html>"
+
+
+def unquote(data: bytes) -> bytes:
+    """Снимает удвоение точек, как SMTP сервер при приеме DATA."""
+    return re.sub(rb"(?m)^\.", b"", data)
+
+
+def parse(data: bytes) -> EmailMessage:
+    return message_from_bytes(data, policy=default)
+
+
+def email_bytes(msg: EmailMessage) -> bytes:
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+
+def content(part: EmailMessage) -> str | bytes:
+    value = part.get_content()
+    # email кодирует текст в base64 с LF, а 8bit уходит с CRLF: переводы строк в тексте равнозначны
+    return value.replace("\r\n", "\n") if isinstance(value, str) else value
+
+
+def summary(msg: EmailMessage) -> dict:
+    """Содержимое письма без деталей кодирования: заголовки и части в порядке обхода."""
+    return {
+        "from": str(msg["From"]),
+        "to": str(msg["To"]),
+        "subject": str(msg["Subject"]),
+        "type": msg.get_content_type(),
+        "parts": [
+            (part.get_content_type(), part.get_filename(), content(part))
+            for part in msg.walk()
+            if not part.is_multipart()
+        ],
+    }
+
+
+def assert_smtp_lines(data: bytes) -> None:
+    assert b"\n" not in data.replace(b"\r\n", b"")
+    assert b"\r" not in data.replace(b"\r\n", b"")
+    assert max(len(line) for line in data.split(b"\r\n")) <= 998
+
+
+@pytest.mark.parametrize("text", TEXTS.values(), ids=TEXTS.keys())
+@pytest.mark.parametrize("parts", ["text", "html", "both"])
+@pytest.mark.parametrize("subject", ["Your order", "Ваш заказ отправлен", "Long subject " * 10])
+def test_prepared_message_matches_email_builder(text, parts, subject):
+    message = text if parts in ("text", "both") else None
+    body = HTML if parts in ("html", "both") else None
+
+    prepared = prepare_message("user@example.com", subject, message, body)
+    built = build_message("user@example.com", subject, message, body, None)
+
+    fast, reference = summary(parse(prepared.data)), summary(parse(email_bytes(built)))
+    if parts == "html":
+        # email оборачивает одну HTML часть в multipart/alternative, быстрый путь пишет ее без обертки
+        assert (fast.pop("type"), reference.pop("type")) == ("text/html", "multipart/alternative")
+    assert fast == reference
+    assert_smtp_lines(prepared.data)
+
+
+def test_prepared_message_without_body():
+    prepared = prepare_message("user@example.com", "Empty", None, None)
+    assert summary(parse(prepared.data)) == summary(parse(email_bytes(build_message(
+        "user@example.com", "Empty", None, None, None
+    ))))
+
+
+def test_prepared_message_sender():
+    prepared = prepare_message("user@example.com", "Subject", "text", None)
+    assert prepared.from_addr == "sender@example.com"
+    assert str(parse(prepared.data)["From"]) == settings.email_from
+
+
+def test_multiple_recipients_are_not_disclosed():
+    to = ["first@example.com", "second@example.org"]
+    prepared = prepare_message(to, "Subject", "text", HTML)
+    built = build_message(to, "Subject", "text", HTML, None)
+
+    assert envelope_recipients(to) == to
+    assert envelope_recipients("one@example.com") == ["one@example.com"]
+    assert str(parse(prepared.data)["To"]) == "undisclosed-recipients:;"
+    assert summary(parse(prepared.data)) == summary(parse(email_bytes(built)))
+
+
+def test_leading_dots_survive_dot_stuffing():
+    prepared = prepare_message("user@example.com", "Dots", TEXTS["leading dots"], HTML)
+    quoted = quote_data(prepared.data)
+
+    assert not re.search(rb"(?m)^\.(?!\.)", quoted)
+    assert summary(parse(unquote(quoted))) == summary(parse(prepared.data))
+
+
+def test_header_injection_is_rejected():
+    with pytest.raises(ValueError):
+        header_line("Subject", "Hello\r\nBcc: victim@example.com")
+    with pytest.raises(ValueError):
+        prepare_message("user@example.com\r\nBcc: victim@example.com", "Subject", "text", None)
+
+
+def test_guess_mime_type():
+    assert guess_mime_type("report.pdf") == ("application", "pdf")
+    assert guess_mime_type("photo.png") == ("image", "png")
+    assert guess_mime_type("no-extension") == ("application", "octet-stream")
+
+
+ATTACHMENT_SIZES = [0, 1, 56, 57, 58, ATTACHMENT_CHUNK_SIZE - 1, ATTACHMENT_CHUNK_SIZE + 1, 3 * ATTACHMENT_CHUNK_SIZE]
+
+
+def attachment_data(size: int) -> bytes:
+    return random.Random(size).randbytes(size)
+
+
+def reference_message(to, subject, message, body, files) -> EmailMessage:
+    """То же письмо, собранное целиком средствами email."""
+    msg = EmailMessage()
+    msg["From"] = settings.email_from
+    msg["To"] = to
+    msg["Subject"] = subject
+    if message:
+        msg.set_content(message)
+    if body:
+        msg.add_alternative(body, subtype="html")
+    for filename, data in files:
+        maintype, subtype = guess_mime_type(filename)
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    return msg
+
+
+@pytest.mark.parametrize("size", ATTACHMENT_SIZES)
+def test_streaming_attachment_round_trip(size):
+    files = [("report.pdf", attachment_data(size)), ("Отчет за май.txt", b".leading dot\r\n.line\n")]
+    attachments = [
+        {"filename": filename, "content": base64.b64encode(data).decode()} for filename, data in files
+    ]
+    streaming = build_message("user@example.com", "Вложения", TEXTS["leading dots"], HTML, attachments)
+    assert isinstance(streaming, StreamingMessage)
+
+    chunks = list(streaming.chunks())
+    assert all(chunk.endswith(b"\r\n") for chunk in chunks)
+    data = b"".join(chunks)
+    assert_smtp_lines(data)
+
+    reference = reference_message("user@example.com", "Вложения", TEXTS["leading dots"], HTML, files)
+    assert summary(parse(unquote(data))) == summary(parse(email_bytes(reference)))
+
+
+def test_streaming_attachments_without_body():
+    files = [("a.bin", attachment_data(100)), ("b.png", attachment_data(ATTACHMENT_CHUNK_SIZE + 5))]
+    attachments = [{"filename": name, "content": base64.b64encode(data).decode()} for name, data in files]
+    streaming = build_message(["a@example.com", "b@example.com"], "Files", None, None, attachments)
+
+    parsed = parse(unquote(b"".join(streaming.chunks())))
+    assert str(parsed["To"]) == "undisclosed-recipients:;"
+    assert [(part.get_filename(), part.get_content()) for part in parsed.iter_attachments()] == files
+
+
+@pytest.mark.parametrize("size", [0, 1, 57, 1000, 57 * 100 + 13])
+def test_encode_base64_matches_stdlib_for_any_split(size):
+    data = attachment_data(size)
+    rng = random.Random(size)
+    cuts = sorted(rng.sample(range(size + 1), min(size + 1, 10)))
+    pieces = [memoryview(data)[start:end] for start, end in zip([0, *cuts], [*cuts, size], strict=True)]
+
+    encoded = b"".join(encode_base64(pieces))
+    assert encoded == base64.encodebytes(data).replace(b"\n", b"\r\n")
+
+
+def test_streaming_long_unicode_subject():
+    subject = " ".join(["Длинная тема письма"] * 10)
+    streaming = build_message("user@example.com", subject, "text", None, [
+        {"filename": "a.txt", "content": base64.b64encode(b"abc").decode()},
+    ])
+    data = b"".join(streaming.chunks())
+
+    assert_smtp_lines(data)
+    assert str(parse(unquote(data))["Subject"]) == subject
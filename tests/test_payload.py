@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from pydantic import ValidationError
+
+from src.database.rabbit import BulkEmailMessage, EmailMessage, MessageInfo, RabbitReader, payload_adapter
+
+
+def incoming(body: bytes) -> SimpleNamespace:
+    return SimpleNamespace(
+        body=body, exchange="emails", routing_key="send", delivery_tag=7, message_id="message-id"
+    )
+
+
+async def test_decode_single_message():
+    payload = {"to": "user@example.com", "subject": "Subject", "template": "welcome", "context": {"name": "Имя"}}
+    info = await RabbitReader.decode_message(incoming(orjson.dumps(payload)))
+
+    assert isinstance(info.message, EmailMessage)
+    assert info.message.model_dump(exclude_none=True) == payload
+    assert (info.message_meta.delivery_tag, info.message_meta.message_id) == (7, "message-id")
+
+
+async def test_decode_bulk_message():
+    payload = {
+        "subject": "Subject",
+        "template": "news",
+        "context": {"issue": 1},
+        "recipients": [{"to": "a@example.com"}, {"to": "b@example.com", "context": {"name": "B"}}],
+    }
+    info = await RabbitReader.decode_message(incoming(orjson.dumps(payload)))
+
+    assert isinstance(info.message, BulkEmailMessage)
+    assert [recipient.to for recipient in info.message.recipients] == ["a@example.com", "b@example.com"]
+    assert info.message.recipients[1].context == {"name": "B"}
+
+
+async def test_decode_invalid_json_is_skipped():
+    assert await RabbitReader.decode_message(incoming(b"{not json")) is None
+
+
+async def test_decode_schema_error_raises():
+    with pytest.raises(ValidationError):
+        await RabbitReader.decode_message(incoming(b'{"subject": "no recipient"}'))
+    with pytest.raises(ValidationError):
+        await RabbitReader.decode_message(incoming(b'{"subject": "Subject", "recipients": "a@example.com"}'))
+
+
+def test_message_info_uses_the_same_discriminator():
+    single = MessageInfo.model_validate({"message": {"to": "a@example.com", "subject": "s"}, "message_meta": {}})
+    bulk = MessageInfo.model_validate({
+        "message": {"subject": "s", "recipients": [{"to": "a@example.com"}]},
+        "message_meta": {},
+    })
+
+    assert isinstance(single.message, EmailMessage)
+    assert isinstance(bulk.message, BulkEmailMessage)
+
+
+@pytest.mark.parametrize("to", ["", "   ", "a@example.com\r\nBcc: b@example.com", "a@example.com>", "<a@example.com"])
+def test_bad_recipient_is_rejected(to):
+    with pytest.raises(ValidationError):
+        payload_adapter.validate_python({"to": to, "subject": "Subject"})
+    with pytest.raises(ValidationError):
+        payload_adapter.validate_python({"subject": "Subject", "recipients": [{"to": "ok@example.com"}, {"to": to}]})
+
+
+def test_good_recipients_are_accepted():
+    single = payload_adapter.validate_python({"to": "user@example.com", "subject": "Subject"})
+    bulk = payload_adapter.validate_python({"subject": "Subject", "recipients": [{"to": "user@пример.рф"}]})
+
+    assert isinstance(single, EmailMessage)
+    assert isinstance(bulk, BulkEmailMessage)
+
+
+def test_idempotency_key_longer_than_the_column_is_rejected():
+    with pytest.raises(ValidationError):
+        payload_adapter.validate_python({"to": "user@example.com", "subject": "Subject", "idempotency_key": "k" * 256})
+    with pytest.raises(ValidationError):
+        payload_adapter.validate_python({"subject": "Subject", "idempotency_key": "k" * 256, "recipients": []})
@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiormq.exceptions import ChannelNotFoundEntity
+
+from src.database.rabbit import RabbitConnection, RabbitReader
+from src.settings.rabbit import RabbitSettings
+
+
+class FakeChannel:
+    def __init__(self, queues: set[str]) -> None:
+        self.queues = queues
+        self.is_closed = False
+        self.declared: list[str] = []
+
+    async def set_qos(self, prefetch_count: int) -> None:
+        pass
+
+    async def get_queue(self, name: str) -> SimpleNamespace:
+        if name not in self.queues:
+            self.is_closed = True
+            raise ChannelNotFoundEntity(f"NOT_FOUND - no queue '{name}'")
+        return SimpleNamespace(name=name)
+
+    async def declare_queue(self, name: str, **kwargs) -> SimpleNamespace:
+        self.queues.add(name)
+        self.declared.append(name)
+        return SimpleNamespace(name=name)
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+class FakeConnection:
+    def __init__(self, queues: set[str]) -> None:
+        self.queues = queues
+        self.channels: list[FakeChannel] = []
+
+    async def channel(self) -> FakeChannel:
+        self.channels.append(FakeChannel(self.queues))
+        return self.channels[-1]
+
+
+async def reattach(queues: set[str]) -> tuple[RabbitConnection, FakeConnection]:
+    rabbit = RabbitConnection(RabbitSettings(exchange=None))
+    rabbit._topology_declared = True
+    rabbit.connection = FakeConnection(queues)
+    await rabbit._open_channel()
+    await rabbit._attach_topology()
+    return rabbit, rabbit.connection
+
+
+async def test_existing_queue_is_attached_without_declare():
+    rabbit, connection = await reattach({"email_queue"})
+
+    assert len(connection.channels) == 1
+    assert connection.channels[0].declared == []
+    assert rabbit.queue.name == "email_queue"
+
+
+async def test_missing_queue_is_declared_on_a_new_channel():
+    rabbit, connection = await reattach(set())
+
+    first, second = connection.channels
+    assert first.is_closed
+    assert second.declared == ["email_queue"]
+    assert rabbit.channel is second
+    assert rabbit.queue.name == "email_queue"
+
+
+class SlowQueue:
+    async def get(self, fail: bool, timeout: float):
+        await asyncio.sleep(timeout)
+        raise asyncio.TimeoutError
+
+
+async def test_stop_reading_interrupts_basic_get():
+    reader = RabbitReader(RabbitSettings(read_mode="get", timeout_seconds=30))
+
+    async def get_connection():
+        return SimpleNamespace(queue=SlowQueue())
+
+    reader._get_connection = get_connection
+    read = asyncio.create_task(reader.read())
+    await asyncio.sleep(0.01)
+    await reader.stop_reading()
+
+    assert await asyncio.wait_for(read, timeout=1) is None
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+
+from src.service.rate_limiter import SendRateLimiter, TokenBucket, recipient_domain
+from src.settings.app import settings
+
+
+def limiter(**kwargs) -> SendRateLimiter:
+    params = {
+        "account_rate": 0,
+        "account_burst": 1,
+        "domain_rate": 0,
+        "domain_burst": 1,
+        "domain_rates": {},
+        "max_wait": 0,
+    }
+    return SendRateLimiter(**{**params, **kwargs})
+
+
+def test_recipient_domain():
+    assert recipient_domain("User@Example.COM") == "example.com"
+    assert recipient_domain("weird@name@gmail.com") == "gmail.com"
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.1, abs=0.01)
+    # Неудачная попытка не занимает токен
+    assert bucket.try_acquire() == pytest.approx(0.1, abs=0.01)
+
+
+def test_token_bucket_drain():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.drain()
+    assert bucket.try_acquire() == pytest.approx(0.1, abs=0.01)
+
+
+async def test_unlimited_sends_immediately():
+    rate_limiter = limiter()
+    assert [await rate_limiter.acquire(f"user{i}@example.com") for i in range(100)] == [None] * 100
+
+
+async def test_deferred_emails_are_spread_at_domain_rate():
+    rate_limiter = limiter(domain_rate=2, domain_burst=1)
+    first, *delays = [await rate_limiter.acquire("user@example.com") for _ in range(4)]
+
+    assert first is None
+    assert delays == pytest.approx([0.5, 1.0, 1.5], abs=0.05)
+
+
+async def test_short_wait_is_waited_in_place():
+    rate_limiter = limiter(domain_rate=20, domain_burst=1, max_wait=1)
+    started = time.monotonic()
+    results = [await rate_limiter.acquire("user@example.com") for _ in range(3)]
+
+    assert results == [None, None, None]
+    assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+
+
+async def test_domain_overrides_are_case_insensitive():
+    rate_limiter = limiter(domain_rate=1, domain_rates={"Gmail.com": 0})
+    gmail = [await rate_limiter.acquire("user@GMAIL.com") for _ in range(5)]
+    other = [await rate_limiter.acquire("user@example.com") for _ in range(2)]
+
+    assert gmail == [None] * 5
+    assert other[0] is None
+    assert other[1] == pytest.approx(1.0, abs=0.05)
+
+
+async def test_throttled_drains_only_its_domain():
+    rate_limiter = limiter(domain_rate=0.5, domain_burst=5)
+    delay = rate_limiter.throttled("user@slow.com")
+
+    assert delay == pytest.approx(max(settings.email_retry_delay, 2), abs=0.05)
+    assert await rate_limiter.acquire("user@slow.com") > delay
+    assert await rate_limiter.acquire("user@fast.com") is None
+
+
+def test_throttled_without_domain_limit_uses_retry_delay():
+    assert limiter().throttled("user@example.com") == settings.email_retry_delay
+
+
+async def test_account_tokens_are_shared_round_robin_between_domains():
+    rate_limiter = limiter(account_rate=100, account_burst=1)
+    order = []
+
+    async def send(address: str) -> None:
+        await rate_limiter.acquire(address)
+        order.append(recipient_domain(address))
+
+    await asyncio.gather(*(send(f"user{i}@busy.com") for i in range(5)), send("user@quiet.com"))
+
+    # Первый токен из запаса, дальше домены чередуются: quiet не ждет всех писем busy
+    assert order.index("quiet.com") <= 2
+    assert order.count("busy.com") == 5
@@ -0,0 +1,80 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from src.service import renderer
+from src.service.renderer import RenderCache, RenderedBody
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(renderer, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def body(text: str) -> RenderedBody:
+    return RenderedBody.from_body(text)
+
+
+def test_make_key_ignores_context_key_order():
+    assert RenderCache.make_key("t", {"a": 1, "b": 2}) == RenderCache.make_key("t", {"b": 2, "a": 1})
+    assert RenderCache.make_key("t", {"a": 1}) != RenderCache.make_key("u", {"a": 1})
+    assert RenderCache.make_key("t", None) != RenderCache.make_key("t", {})
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = RenderCache(max_bytes=10_000, ttl=60)
+    cache.put("key", body("hello"))
+
+    clock.now += 59
+    assert cache.get("key") == body("hello")
+    clock.now += 2
+    assert cache.get("key") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache._size == 0
+
+
+def test_least_recently_used_is_evicted_by_size(clock):
+    size = sys.getsizeof("x" * 100)
+    cache = RenderCache(max_bytes=size * 2, ttl=60)
+    cache.put("a", body("a" * 100))
+    cache.put("b", body("b" * 100))
+    assert cache.get("a") is not None
+    cache.put("c", body("c" * 100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache._size == size * 2
+
+
+def test_body_larger_than_cache_is_not_stored(clock):
+    cache = RenderCache(max_bytes=100, ttl=60)
+    cache.put("small", body("x"))
+    cache.put("big", body("x" * 1000))
+
+    assert cache.get("big") is None
+    assert cache.get("small") is not None
+
+
+def test_replacing_entry_keeps_size(clock):
+    cache = RenderCache(max_bytes=10_000, ttl=60)
+    cache.put("key", body("x" * 100))
+    cache.put("key", body("y" * 200))
+
+    assert cache.get("key") == body("y" * 200)
+    assert cache._size == sys.getsizeof("y" * 200)
+
+
+def test_disabled_cache():
+    assert not RenderCache(max_bytes=0, ttl=60).enabled
@@ -0,0 +1,164 @@
+import asyncio
+import smtplib
+
+import pytest
+
+from src.service.async_smtp import AsyncSMTP
+from src.service.message_assembly import prepare_message
+from src.service.smtp_pool import AsyncSMTPConnectionPool, SMTPConnectionPool
+from src.settings.app import settings
+
+
+class ScriptedSMTPServer:
+    """SMTP сервер для тестов: записывает команды и отвечает по сценарию.
+
+    replies - очередь ответов на команду (MAIL, RCPT, RSET..., "." - на конец DATA),
+    ответ "drop" закрывает соединение.
+    """
+
+    def __init__(self) -> None:
+        self.commands: list[str] = []
+        self.replies: dict[str, list[str]] = {}
+        self.connections = 0
+        self.port = 0
+        self._server: asyncio.Server | None = None
+
+    async def __aenter__(self) -> "ScriptedSMTPServer":
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        writer.write(b"220 scripted\r\n")
+        while line := await reader.readline():
+            command = line.decode().rstrip("\r\n")
+            self.commands.append(command)
+            verb = command.split(" ", 1)[0].upper()
+            queued = self.replies.get(verb)
+            reply = queued.pop(0) if queued else {
+                "EHLO": "250-scripted\r\n250 AUTH PLAIN",
+                "AUTH": "235 ok",
+                "DATA": "354 go ahead",
+                "QUIT": "221 bye",
+            }.get(verb, "250 ok")
+            if reply == "drop":
+                break
+            writer.write(reply.encode() + b"\r\n")
+            if verb == "DATA" and reply.startswith("354"):
+                while await reader.readline() not in (b".\r\n", b""):
+                    pass
+                queued = self.replies.get(".")
+                reply = queued.pop(0) if queued else "250 queued"
+                if reply == "drop":
+                    break
+                writer.write(reply.encode() + b"\r\n")
+            if verb == "QUIT":
+                break
+        writer.close()
+
+    def sent(self, verb: str) -> list[str]:
+        return [command for command in self.commands if command.upper().startswith(verb)]
+
+
+def pool_for(server: ScriptedSMTPServer, pool_class: type = AsyncSMTPConnectionPool):
+    return pool_class(settings.model_copy(update={
+        "smtp_host": "127.0.0.1",
+        "smtp_port": server.port,
+        "smtp_starttls": False,
+        "smtp_pool_noop_interval": 60,
+    }))
+
+
+MESSAGE = prepare_message("user@example.com", "Subject", "text", None)
+
+
+async def test_crlf_in_address_is_not_sent_as_a_command():
+    async with ScriptedSMTPServer() as server:
+        client = AsyncSMTP("127.0.0.1", server.port, timeout=5)
+        await client.connect()
+        with pytest.raises(ValueError):
+            await client.sendmail("sender@example.com", ["a@example.com>\r\nRCPT TO:<evil@example.com"], b"x\r\n")
+        await client.quit()
+
+    assert server.sent("RCPT") == []
+
+
+async def test_connection_is_pooled_after_successful_rset():
+    async with ScriptedSMTPServer() as server:
+        server.replies["MAIL"] = ["550 sender refused"]
+        pool = pool_for(server)
+        with pytest.raises(smtplib.SMTPSenderRefused):
+            await pool.send_message(MESSAGE, ["user@example.com"])
+        await pool.send_message(MESSAGE, ["user@example.com"])
+        await pool.close()
+
+    assert server.connections == 1
+
+
+async def test_connection_is_dropped_when_rset_fails():
+    async with ScriptedSMTPServer() as server:
+        server.replies["MAIL"] = ["550 sender refused"]
+        server.replies["RSET"] = ["421 closing"]
+        pool = pool_for(server)
+        with pytest.raises(smtplib.SMTPSenderRefused):
+            await pool.send_message(MESSAGE, ["user@example.com"])
+        assert not pool._idle
+
+        await pool.send_message(MESSAGE, ["user@example.com"])
+        await pool.close()
+
+    assert server.connections == 2
+
+
+async def test_pooled_connection_dropped_before_data_is_retried():
+    async with ScriptedSMTPServer() as server:
+        pool = pool_for(server)
+        await pool.send_message(MESSAGE, ["user@example.com"])
+        server.replies["MAIL"] = ["drop"]
+        await pool.send_message(MESSAGE, ["user@example.com"])
+        await pool.close()
+
+    assert server.connections == 2
+    assert len(server.sent("DATA")) == 2
+
+
+async def test_connection_dropped_after_data_is_not_retried():
+    async with ScriptedSMTPServer() as server:
+        pool = pool_for(server)
+        await pool.send_message(MESSAGE, ["user@example.com"])
+        server.replies["."] = ["drop"]
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            await pool.send_message(MESSAGE, ["user@example.com"])
+
+    assert server.connections == 1
+    assert len(server.sent("DATA")) == 2
+
+
+async def test_new_connection_dropped_is_not_retried():
+    async with ScriptedSMTPServer() as server:
+        server.replies["MAIL"] = ["drop"]
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            await pool_for(server).send_message(MESSAGE, ["user@example.com"])
+
+    assert server.connections == 1
+
+
+async def test_thread_pool_retries_only_before_data():
+    async with ScriptedSMTPServer() as server:
+        pool = pool_for(server, SMTPConnectionPool)
+        await asyncio.to_thread(pool.send_message, MESSAGE, ["user@example.com"])
+        server.replies["MAIL"] = ["drop"]
+        await asyncio.to_thread(pool.send_message, MESSAGE, ["user@example.com"])
+        assert server.connections == 2
+
+        server.replies["."] = ["drop"]
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            await asyncio.to_thread(pool.send_message, MESSAGE, ["user@example.com"])
+        await asyncio.to_thread(pool.close)
+
+    assert server.connections == 2
+    assert len(server.sent("DATA")) == 3
@@ -0,0 +1,50 @@
+import orjson
+import pytest
+
+from src.settings.app import settings
+from src.supervisor import connection_budget, worker_environment
+
+
+def configured(pool_size: int = 10, max_overflow: int = 5, **kwargs):
+    postgres = settings.postgres.model_copy(update={"pool_size": pool_size, "max_overflow": max_overflow})
+    return settings.model_copy(update={"postgres": postgres, **kwargs})
+
+
+def test_limits_are_split_between_processes():
+    env = worker_environment(configured(
+        smtp_pool_size=10,
+        render_processes=8,
+        smtp_rate_limit=12,
+        domain_rate_limit=3,
+        domain_rate_limits={"gmail.com": 6},
+    ), processes=3, budget=None)
+
+    assert env["EMAIL_SERVICE_PROCESSES"] == "1"
+    assert env["EMAIL_SERVICE_SMTP_POOL_SIZE"] == "3"
+    assert env["EMAIL_SERVICE_RENDER_PROCESSES"] == "2"
+    assert float(env["EMAIL_SERVICE_SMTP_RATE_LIMIT"]) == 4
+    assert float(env["EMAIL_SERVICE_DOMAIN_RATE_LIMIT"]) == 1
+    assert orjson.loads(env["EMAIL_SERVICE_DOMAIN_RATE_LIMITS"]) == {"gmail.com": 2}
+    assert "EMAIL_SERVICE_POSTGRES_POOL_SIZE" not in env
+
+
+def test_limits_never_drop_below_one():
+    env = worker_environment(configured(smtp_pool_size=2, render_processes=1), processes=4, budget=2)
+
+    assert env["EMAIL_SERVICE_SMTP_POOL_SIZE"] == "1"
+    assert env["EMAIL_SERVICE_RENDER_PROCESSES"] == "1"
+    assert env["EMAIL_SERVICE_POSTGRES_POOL_SIZE"] == "1"
+    assert env["EMAIL_SERVICE_POSTGRES_MAX_OVERFLOW"] == "0"
+
+
+@pytest.mark.parametrize(("budget", "pool_size", "max_overflow"), [(80, 10, 5), (40, 10, 0), (24, 6, 0), (36, 9, 0)])
+def test_postgres_budget_is_split_between_processes(budget, pool_size, max_overflow):
+    env = worker_environment(configured(pool_size=10, max_overflow=5), processes=4, budget=budget)
+
+    assert env["EMAIL_SERVICE_POSTGRES_POOL_SIZE"] == str(pool_size)
+    assert env["EMAIL_SERVICE_POSTGRES_MAX_OVERFLOW"] == str(max_overflow)
+    assert 4 * (pool_size + max_overflow) <= budget
+
+
+def test_explicit_connection_budget_skips_postgres():
+    assert connection_budget(configured(postgres_connection_budget=50)) == 50